@@ -1,14 +1,14 @@
 import logging
 import os
-import json
 from dotenv import load_dotenv
-import random
-import aiohttp  # обязательно!
 import asyncio
 import sys
+from collections import Counter
 sys.stdout.reconfigure(line_buffering=True)
 
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.constants import ChatAction
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -19,10 +19,35 @@ from telegram.ext import (
     CallbackQueryHandler,
 )
 
-from trakt_recommendation import get_movies_by_genre_and_people  # твоя функция
+from trakt_recommendation import (  # твоя функция
+    get_genre_pool,
+    prefetch_genre,
+    poster_file_id,
+    poster_rejected,
+    remember_poster,
+    reject_poster,
+    forget_poster,
+    start_trakt_client,
+    start_catalog_builder,
+    close_trakt_client,
+    cache_stats,
+)
+from history_store import HistoryStore, HistoryWriter
+from hf_client import ask_about_movie, stream_about_movie, start_hf_client, close_hf_client, hf_stats
+from local_answers import answer_locally, fallback_answer
+from webhook import PerChatUpdateProcessor, serve_webhook
+from dispatcher import run_dispatcher
+from persistence import SqlitePersistence
+from metrics import stage_latency, fallbacks, transitions, register_collector, start_metrics_server, stop_metrics_server
+from rate_limit import UserRateLimiter, ALLOWED, LIMITED
+from localization import LANGUAGES, DEFAULT_LANGUAGE, get_text, match_option, on_languages_changed
+from movie_index import PEOPLE_AUDIENCE, TIME_SLOTS, SEEN_LIMIT, movie_key, remember_seen, pick_without_repeat
+import personalization
 load_dotenv()
 
 TG_BOT_TOKEN = os.getenv("TG_BOT_TOKEN")
+# Свой Bot API сервер (или FakeTelegram в harness); пусто — api.telegram.org
+TG_API_URL = os.getenv("TG_API_URL")
 if not TG_BOT_TOKEN:
     raise ValueError("TG_BOT_TOKEN nav norādīts Railway vai .env failā")
 
@@ -35,9 +60,6 @@ CHOOSE_PEOPLE, CHOOSE_GENRE, CHOOSE_TIME, CHOOSE_RATING, CHOOSE_REPEAT, WAITING_
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-LANGUAGES = ["Latviešu", "English"]
-DEFAULT_LANGUAGE = "Latviešu"
-
 GENRE_EMOJIS = {
     "🎭": "drama",
     "😂": "comedy",
@@ -51,104 +73,182 @@ TIME_EMOJIS = ["🌅", "🌇", "🌃"]
 
 RATING_OPTIONS = ["5+", "6+", "7+", "8+", "9+"]
 
-HISTORY_FILE = "user_history.json"
+HISTORY_FILE = "user_history.json"  # старый формат, только для миграции
+HISTORY_DB = os.getenv("HISTORY_DB", "user_history.db")
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+
+# Потоковые ответы AI: сообщение-заглушка правится по мере прихода текста,
+# но не чаще раза в AI_EDIT_INTERVAL секунд (лимиты Telegram на edit).
+# Выключено по умолчанию: каждый поток — отдельный запрос мимо PromptBatcher
+# и мимо слияния одинаковых вопросов в ask_about_movie
+AI_STREAMING = os.getenv("AI_STREAMING", "0") == "1"
+AI_EDIT_INTERVAL = float(os.getenv("AI_EDIT_INTERVAL", "1.0"))
+AI_PLACEHOLDER = "🤖 …"
+
+# Режим webhook включается, если задан публичный WEBHOOK_URL; иначе long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Сколько апдейтов разных чатов обрабатываем одновременно
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+
+# WORKERS > 1: этот процесс становится фронтом (dispatcher.py) и запускает
+# столько воркеров; WORKER_ID/WORKER_PORT/WORKER_SECRET ставит им сам фронт
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_ID = os.getenv("WORKER_ID")
+WORKER_PORT = int(os.getenv("WORKER_PORT", "0"))
+WORKER_SECRET = os.getenv("WORKER_SECRET")
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8600"))
+
+# user_data и состояния диалогов переживают рестарт; пишем раз в PERSISTENCE_INTERVAL секунд
+STATE_DB = os.getenv("STATE_DB", "state.db")
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "30"))
+# Через сколько секунд тишины persistence забывает пользователя (данные остаются в базе)
+PERSISTENCE_IDLE_TTL = float(os.getenv("PERSISTENCE_IDLE_TTL", "3600"))
+
+# Локальный Prometheus /metrics; пустой METRICS_PORT выключает сервер
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT", "9100")
+
+# Лимит на подбор фильма: RATE_LIMIT_RATE в секунду, до RATE_LIMIT_BURST подряд;
+# тот же тап чаще RATE_LIMIT_DEBOUNCE секунд считается дублем
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "0.5"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_DEBOUNCE = float(os.getenv("RATE_LIMIT_DEBOUNCE", "0.7"))
+RATE_LIMIT_IDLE = float(os.getenv("RATE_LIMIT_IDLE", "600"))
+
+rate_limiter = UserRateLimiter(RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_DEBOUNCE, RATE_LIMIT_IDLE)
+
+def build_keyboards(lang):
+    """Клавиатуры одного языка; собираются при первом обращении и дальше только переиспользуются."""
+    def reply(rows):
+        return ReplyKeyboardMarkup(rows + [[get_text("cancel_option", lang)]], one_time_keyboard=True, resize_keyboard=True)
+
+    return {
+        "people": reply([[get_text("people_solo", lang), get_text("people_together", lang)]]),
+        "genre": reply([[e] for e in GENRE_EMOJIS]),
+        "time": reply([[e] for e in TIME_EMOJIS]),
+        "rating": reply([[r] for r in RATING_OPTIONS]),
+        "language": reply([[language] for language in LANGUAGES]),
+        "movie": InlineKeyboardMarkup([
+            [InlineKeyboardButton(get_text("ask_ai_option", lang), callback_data="ask_ai")],
+            [InlineKeyboardButton(get_text("repeat_option", lang), callback_data="repeat_movie")],
+            [InlineKeyboardButton(get_text("restart_option", lang), callback_data="restart")],
+        ]),
+    }
 
-def save_history(data):
-    try:
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        logger.error(f"History save failed: {e}")
+KEYBOARDS = {}
+# новый язык из register_language() меняет и тексты, и клавиатуру выбора языка у всех
+on_languages_changed(KEYBOARDS.clear)
 
-def get_text(key, lang):
-    texts = {
-        "start": {
-            "Latviešu": "Čau, esmu Meowie!🎬\nEs palīdzēšu atrast filmu vakaram.\nNorādi, vai Tu skaties vienatnē vai divatā.\nIzvēlies žanru un laiku, kad plāno skatīties 🐾\n\nVai skatīsies viens vai kopā?",
-            "English": "Hi, I'm Meowie!🎬\nI'll help you find a movie for tonight.\nTell me if you're watching alone or together.\nChoose a genre and time 🐾\n\nAre you watching alone or with someone?"
-        },
-        "genre_prompt": {
-            "Latviešu": "Kādu žanru vēlies? Izvēlies:",
-            "English": "What genre do you want? Choose:"
-        },
-        "time_prompt": {
-            "Latviešu": "Cikos skatīsieties filmu?",
-            "English": "When will you watch the movie?"
-        },
-        "rating_prompt": {
-            "Latviešu": "Izvēlies minimālo filmas vērtējumu:",
-            "English": "Choose minimum movie rating:"
-        },
-        "invalid_rating": {
-            "Latviešu": "Lūdzu, ievadi derīgu vērtējumu no 0 līdz 10.",
-            "English": "Please enter a valid rating from 0 to 10."
-        },
-        "not_found": {
-            "Latviešu": "Neizdevās atrast filmu. Pamēģini vēlāk.",
-            "English": "Couldn't find a movie. messageHandler again later."
-        },
-        "cancel": {
-            "Latviešu": "Filmas meklēšana atcelta.",
-            "English": "Movie search cancelled."
-        },
-        "choose_language": {
-            "Latviešu": "Izvēlies valodu / Choose a language:",
-            "English": "Izvēlies valodu / Choose a language:"
-        },
-        "repeat_prompt": {
-            "Latviešu": "Izvēlies, ko darīt tālāk:",
-            "English": "Choose what to do next:"
-        },
-        "repeat_option": {
-            "Latviešu": "🔄 Vēl filmu",
-            "English": "🔄 Another movie"
-        },
-        "restart_option": {
-            "Latviešu": "🔁 Sākt no jauna",
-            "English": "🔁 Restart"
-        },
-        "choose_repeat_invalid": {
-            "Latviešu": "Lūdzu, izvēlies no piedāvātajām opcijām.",
-            "English": "Please choose from the offered options."
-        },
-        "history_empty": {
-            "Latviešu": "Vēsture ir tukša.",
-            "English": "History is empty."
-        }
-    }
-    return texts[key].get(lang, texts[key][DEFAULT_LANGUAGE])
+def keyboard(name, lang):
+    if lang not in LANGUAGES:
+        lang = DEFAULT_LANGUAGE
+    keyboards = KEYBOARDS.get(lang)
+    if keyboards is None:
+        keyboards = KEYBOARDS[lang] = build_keyboards(lang)
+    return keyboards[name]
+
+def _collect_rate_limit_metrics():
+    return [
+        ("meowie_rate_limit_total", "counter", "Recommendation requests by rate limiter decision.",
+         [({"result": key}, value) for key, value in rate_limiter.stats.items()]),
+        ("meowie_rate_limit_users", "gauge", "Users with an active rate limit bucket.", [({}, len(rate_limiter))]),
+    ]
 
-async def get_random_movie_by_genre(genre, people, min_rating=0):
-    movies = await get_movies_by_genre_and_people(genre, people)
-    
-    if not movies:
+register_collector(_collect_rate_limit_metrics)
+
+async def allow_recommendation(update, lang, action):
+    """
+    Пропускает подбор фильма через лимитер. При отказе Trakt, история и новое
+    сообщение не трогаются: за серию отказов предупреждаем один раз (на кнопку —
+    всплывающей подсказкой), остальные отказы и дубли тапов молча отбрасываем.
+    На нажатие кнопки отвечаем всегда — пустым answer(), если молчим, иначе
+    у клиента крутится индикатор загрузки, пока запрос не истечёт.
+    """
+    user_id = update.effective_user.id
+    result = rate_limiter.check(user_id, action)
+    if result == ALLOWED:
+        return True
+    warn = result == LIMITED and rate_limiter.should_warn(user_id)
+    if update.callback_query is not None:
+        await update.callback_query.answer(get_text("slow_down", lang) if warn else None)
+    elif warn:
+        await update.message.reply_text(get_text("slow_down", lang))
+    return False
+
+async def get_seen(user_id, user_data):
+    """Недавно показанные фильмы пользователя; при первом обращении берём их из истории."""
+    seen = user_data.get("seen")
+    if seen is None:
+        seen = {}
+        if user_id is not None:
+            for item in await get_recent_history(user_id, SEEN_LIMIT):
+                remember_seen(seen, movie_key(item))
+        user_data["seen"] = seen
+    return seen
+
+async def get_taste(user_id, user_data):
+    """Вектор вкуса пользователя; при первом обращении считаем его по истории."""
+    taste = user_data.get("taste")
+    if taste is None:
+        items = await get_recent_history(user_id, SEEN_LIMIT) if user_id is not None else []
+        taste = user_data["taste"] = personalization.taste_from_history(items)
+    return taste
+
+async def get_random_movie_by_genre(genre, people, min_rating, user_data, user_id):
+    pool = await get_genre_pool(genre)
+
+    if not pool:
         logger.warning(f"No movies found for genre={genre}, people={people}")
         return None
 
-    filtered = [m for m in movies if m.get("rating", 0) >= min_rating]
-    
-    logger.info(f"Found {len(filtered)} movies after filtering with min_rating={min_rating} "
-                f"out of {len(movies)} total.")
+    # в user_data лежит текст кнопки; аудиторию узнаём по ключу, чтобы работал любой язык
+    audience = PEOPLE_AUDIENCE.get(match_option(people))
+    slot = TIME_SLOTS.get(user_data.get("time"))
+    seen = await get_seen(user_id, user_data)
+    taste = await get_taste(user_id, user_data) if personalization.enabled() else None
+    if personalization.has_taste(taste):
+        await personalization.prepare(pool)
+        movie, threshold = personalization.pick_personalized(pool, min_rating, taste, seen, audience, slot)
+    else:
+        cycles = user_data.setdefault("cycles", {}).setdefault(genre, {})
+        movie, threshold = pick_without_repeat(pool, min_rating, cycles, seen, audience, slot)
 
-    if not filtered and min_rating > 0:
-        logger.info(f"No movies found with rating >= {min_rating}. messageHandlering without rating filter.")
-        return random.choice(movies)
+    if threshold is not None and threshold < min_rating:
+        fallbacks.inc(kind="rating_fallback")
+        logger.info(f"No movies found with rating >= {min_rating}. Falling back to rating >= {threshold} "
+                    f"({pool.count_at_least(threshold)} of {len(pool)}).")
 
-    return random.choice(filtered) if filtered else None
+    return movie
+
+async def prefetch_likely_genre(user_id, user_data):
+    """Жанр, который пользователь скорее всего выберет: прошлый выбор или самый частый в истории."""
+    genre = user_data.get("genre")
+    if not genre:
+        recent = await get_recent_history(user_id, 20)
+        counts = Counter(item.get("genre") for item in recent if item.get("genre"))
+        genre = counts.most_common(1)[0][0] if counts else None
+    prefetch_genre(genre)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["lang"] = DEFAULT_LANGUAGE
+    # язык, выбранный через /language, сохраняется между диалогами
+    context.user_data.setdefault("lang", DEFAULT_LANGUAGE)
+    # пул жанра греется, пока пользователь отвечает на вопросы
+    context.application.create_task(
+        prefetch_likely_genre(update.effective_user.id, context.user_data), update=update
+    )
     await update.message.reply_text(
         get_text("start", context.user_data["lang"]),
-reply_markup=ReplyKeyboardMarkup(
-    [["Viens", "Kopā"], ["/cancel"]] if context.user_data["lang"] == "Latviešu" else [["Alone", "Together"], ["/cancel"]],
-    one_time_keyboard=True,
-    resize_keyboard=True
-),
+        reply_markup=keyboard("people", context.user_data["lang"]),
     )
     return CHOOSE_PEOPLE
 
 async def choose_people(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text == "/cancel":
+    if match_option(update.message.text) == "cancel_option":
         await cancel(update, context)
         return ConversationHandler.END
     
@@ -156,16 +256,12 @@ async def choose_people(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = context.user_data["lang"]
     await update.message.reply_text(
         get_text("genre_prompt", lang),
-        reply_markup=ReplyKeyboardMarkup(
-            [[e] for e in GENRE_EMOJIS.keys()] + [["/cancel"]],
-            one_time_keyboard=True,
-            resize_keyboard=True
-        ),
+        reply_markup=keyboard("genre", lang),
     )
     return CHOOSE_GENRE
 
 async def choose_genre(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text == "/cancel":
+    if match_option(update.message.text) == "cancel_option":
         await cancel(update, context)
         return ConversationHandler.END
     
@@ -176,18 +272,15 @@ async def choose_genre(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CHOOSE_GENRE
 
     context.user_data["genre"] = genre
+    prefetch_genre(genre)
     await update.message.reply_text(
         get_text("time_prompt", context.user_data["lang"]),
-        reply_markup=ReplyKeyboardMarkup(
-            [[e] for e in TIME_EMOJIS] + [["/cancel"]],
-            one_time_keyboard=True,
-            resize_keyboard=True
-        ),
+        reply_markup=keyboard("time", context.user_data["lang"]),
     )
     return CHOOSE_TIME
 
 async def choose_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text == "/cancel":
+    if match_option(update.message.text) == "cancel_option":
         await cancel(update, context)
         return ConversationHandler.END
     
@@ -196,16 +289,12 @@ async def choose_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text(
         get_text("rating_prompt", lang),
-        reply_markup=ReplyKeyboardMarkup(
-            [[r] for r in RATING_OPTIONS] + [["/cancel"]],
-            one_time_keyboard=True,
-            resize_keyboard=True
-        ),
+        reply_markup=keyboard("rating", lang),
     )
     return CHOOSE_RATING
 
 async def choose_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text == "/cancel":
+    if match_option(update.message.text) == "cancel_option":
         await cancel(update, context)
         return ConversationHandler.END
     
@@ -218,6 +307,9 @@ async def choose_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(get_text("invalid_rating", lang))
         return CHOOSE_RATING
 
+    if not await allow_recommendation(update, lang, "rating"):
+        return CHOOSE_RATING
+
     rating = int(text.rstrip("+"))
     min_rating = 8.5 if rating >= 9 else rating
     context.user_data["min_rating"] = min_rating
@@ -226,69 +318,52 @@ async def choose_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
     people = context.user_data.get("people")
 
     try:
-        movie = await get_random_movie_by_genre(genre, people, min_rating=min_rating)
+        movie = await get_random_movie_by_genre(
+            genre, people, min_rating=min_rating,
+            user_data=context.user_data, user_id=update.effective_user.id,
+        )
         if not movie:
-            await update.message.reply_text(get_text("not_found", lang))
+            await reply_not_found(update.message, lang)
             return CHOOSE_RATING
 
         context.user_data["last_movie"] = movie
 
-        user_id = str(update.effective_user.id)
-        history = await load_history()
-        history.setdefault(user_id, []).append({
-            "title": movie.get("title", "Unknown"),
-            "year": movie.get("year", "----"),
-            "url": movie.get("trakt_url", ""),
-            "people": people,
-            "genre": genre,
-            "time": context.user_data.get("time", ""),
-            "min_rating": min_rating
-        })
-        await save_history(history)
+        add_history(update.effective_user.id, movie, context)
 
         await send_movie_with_buttons(update.message, context, movie, lang)
         return CHOOSE_REPEAT
 
     except Exception as e:
         logger.error(f"Ошибка в choose_rating: {e}")
-        await update.message.reply_text(get_text("not_found", lang))
+        await reply_not_found(update.message, lang)
         return CHOOSE_RATING
 
 async def choose_repeat(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text == "/cancel":
+    if match_option(update.message.text) == "cancel_option":
         await cancel(update, context)
         return ConversationHandler.END
     
-    choice = update.message.text.strip().lower()
+    choice = match_option(update.message.text)
     lang = context.user_data.get("lang", DEFAULT_LANGUAGE)
 
-    repeat_text = get_text("repeat_option", lang).lower()
-    restart_text = get_text("restart_option", lang).lower()
-
-    if choice == repeat_text:
+    if choice == "repeat_option":
+        if not await allow_recommendation(update, lang, "repeat"):
+            return CHOOSE_REPEAT
         genre = context.user_data.get("genre")
         people = context.user_data.get("people")
         min_rating = context.user_data.get("min_rating", 0)
         try:
-            movie = await get_random_movie_by_genre(genre, people, min_rating=min_rating)
+            movie = await get_random_movie_by_genre(
+                genre, people, min_rating=min_rating,
+                user_data=context.user_data, user_id=update.effective_user.id,
+            )
             if not movie:
-                await update.message.reply_text(get_text("not_found", lang))
+                await reply_not_found(update.message, lang)
                 return ConversationHandler.END
 
             context.user_data["last_movie"] = movie
 
-            user_id = str(update.effective_user.id)
-            history = await load_history()
-            history.setdefault(user_id, []).append({
-                "title": movie["title"],
-                "year": movie["year"],
-                "url": movie["trakt_url"],
-                "people": people,
-                "genre": genre,
-                "time": context.user_data.get("time", ""),
-                "min_rating": min_rating
-            })
-            await save_history(history)
+            add_history(update.effective_user.id, movie, context)
 
             await send_movie_with_buttons(update.message, context, movie, lang)
 
@@ -296,16 +371,20 @@ async def choose_repeat(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         except Exception as e:
             logger.error(f"Kļūda: {e}")
-            await update.message.reply_text(get_text("not_found", lang))
+            await reply_not_found(update.message, lang)
             return ConversationHandler.END
 
-    elif choice == restart_text:
+    elif choice == "restart_option":
         return await start(update, context)
 
     else:
         await update.message.reply_text(get_text("choose_repeat_invalid", lang))
         return CHOOSE_REPEAT
 
+async def reply_not_found(message, lang):
+    fallbacks.inc(kind="not_found")
+    await message.reply_text(get_text("not_found", lang))
+
 async def send_movie_with_buttons(message, context, movie, lang):
     title = movie.get("title", "Unknown")
     year = movie.get("year", "----")
@@ -315,21 +394,44 @@ async def send_movie_with_buttons(message, context, movie, lang):
     if url:
         text += f"🔗 <a href='{url}'>Link</a>"
 
-    buttons = [
-        [InlineKeyboardButton("🤖 Ask AI", callback_data="ask_ai")],
-        [InlineKeyboardButton(get_text("repeat_option", lang), callback_data="repeat_movie")],
-        [InlineKeyboardButton(get_text("restart_option", lang), callback_data="restart")],
-    ]
+    with stage_latency.time(stage="telegram_reply"):
+        if await send_poster_card(message, movie, text, keyboard("movie", lang)):
+            return
+        await message.reply_text(
+            text,
+            reply_markup=keyboard("movie", lang),
+            parse_mode="HTML",
+            disable_web_page_preview=True,
+        )
 
-    await message.reply_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(buttons),
-        parse_mode="HTML",
-        disable_web_page_preview=False,
-    )
+async def send_poster_card(message, movie, caption, markup):
+    """
+    Карточка с постером. Если постер уже загружали — шлём сохранённый file_id
+    (один вызов API, без скачивания), иначе URL из каталога и запоминаем file_id.
+    Отвергнутый URL тоже запоминаем, чтобы не слать его заново при каждом показе.
+    False, если постера нет или Telegram его не принял: тогда отправим текст.
+    """
+    file_id = poster_file_id(movie)
+    url = None if poster_rejected(movie) else movie.get("poster")
+    for photo in (file_id, url):
+        if not photo:
+            continue
+        try:
+            sent = await message.reply_photo(photo, caption=caption, parse_mode="HTML", reply_markup=markup)
+        except BadRequest as e:
+            logger.warning(f"Plakātu neizdevās nosūtīt ({movie.get('title')}): {e}")
+            if photo == file_id:
+                await forget_poster(movie)
+            else:
+                await reject_poster(movie)
+            continue
+        if photo != file_id and sent.photo:
+            await remember_poster(movie, sent.photo[-1].file_id)
+        return True
+    return False
 
 async def choose_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text == "/cancel":
+    if match_option(update.message.text) == "cancel_option":
         await cancel(update, context)
         return ConversationHandler.END
     
@@ -347,28 +449,27 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     lang = context.user_data.get("lang", DEFAULT_LANGUAGE)
-    history = await load_history()  # await добавлен
-    user_history = history.get(user_id, [])
+    user_history = await get_recent_history(user_id, 5)
 
     if not user_history:
         await update.message.reply_text(get_text("history_empty", lang))
         return
 
     lines = []
-    for item in user_history[-5:]:
+    for item in user_history:
         lines.append(f"{item['title']} ({item['year']}) - {item['genre']} - {item['people']} - {item['time']}")
     await update.message.reply_text("\n".join(lines))
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     data = query.data
     lang = context.user_data.get("lang", DEFAULT_LANGUAGE)
+    if data == "repeat_movie" and not await allow_recommendation(update, lang, "repeat"):
+        return CHOOSE_REPEAT
+    await query.answer()
 
     if data == "ask_ai":
-        await query.message.reply_text(
-            "Lūdzu, uzraksti savu jautājumu par filmu. Es gaidīšu tavu ziņu."
-        )
+        await query.message.reply_text(get_text("ask_ai_prompt", lang))
         context.user_data["waiting_for_ai_question"] = True
         return WAITING_QUESTION
 
@@ -377,32 +478,24 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         people = context.user_data.get("people")
         min_rating = context.user_data.get("min_rating", 0)
         try:
-            movie = await get_random_movie_by_genre(genre, people, min_rating=min_rating)
+            movie = await get_random_movie_by_genre(
+                genre, people, min_rating=min_rating,
+                user_data=context.user_data, user_id=query.from_user.id,
+            )
             if not movie:
-                await query.message.reply_text(get_text("not_found", lang))
+                await reply_not_found(query.message, lang)
                 return ConversationHandler.END
 
             context.user_data["last_movie"] = movie
 
-            user_id = str(query.from_user.id)
-            history = await load_history()
-            history.setdefault(user_id, []).append({
-                "title": movie["title"],
-                "year": movie["year"],
-                "url": movie["trakt_url"],
-                "people": people,
-                "genre": genre,
-                "time": context.user_data.get("time", ""),
-                "min_rating": min_rating
-            })
-            await save_history(history)
+            add_history(query.from_user.id, movie, context)
 
             await send_movie_with_buttons(query.message, context, movie, lang)
             return CHOOSE_REPEAT
 
         except Exception as e:
             logger.error(f"Kļūda: {e}")
-            await query.message.reply_text(get_text("not_found", lang))
+            await reply_not_found(query.message, lang)
             return ConversationHandler.END
 
     elif data == "restart":
@@ -410,118 +503,278 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await start(update, context)
 
     else:
-        await query.message.reply_text("Nezināma izvēle. Lūdzu, mēģini vēlreiz.")
+        await query.message.reply_text(get_text("unknown_choice", lang))
         return CHOOSE_REPEAT
 
 async def handle_ai_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = context.user_data.get("lang", DEFAULT_LANGUAGE)
 
     if not context.user_data.get("waiting_for_ai_question"):
-        await update.message.reply_text("Lūdzu, izmanto izvēlnes pogas.")
+        await update.message.reply_text(get_text("use_buttons", lang))
         return ConversationHandler.END
 
     context.user_data["waiting_for_ai_question"] = False
     user_question = update.message.text
 
     movie = context.user_data.get("last_movie", {})
-    prompt = f"Film: {movie.get('title', 'unknown')}\nQuestion: {user_question}\nAnswer:"
 
     logger.info(f"User asked AI: {user_question}")
 
-    response = await ask_hf_model(prompt)
-    await update.message.reply_text(response)
-    return CHOOSE_REPEAT
-
+    # Частые вопросы (год, длина, рейтинг, "страшно ли") отвечаем сразу из данных фильма
+    local = answer_locally(movie, user_question, lang)
+    if local:
+        await update.message.reply_text(local)
+        return CHOOSE_REPEAT
 
-# 👉 ВЫНЕСИ ЭТУ ФУНКЦИЮ НИЖЕ, БЕЗ ДОП. ОТСТУПОВ
-async def ask_hf_model(prompt_text):
-    API_URL = "https://api-inference.huggingface.co/models/google/flan-t5-large"
-    headers = {"Authorization": f"Bearer {HF_API_TOKEN}"}
-    payload = {"inputs": prompt_text}
+    fallback = fallback_answer(movie, lang)
+    with stage_latency.time(stage="ai_answer"):
+        if AI_STREAMING:
+            await reply_streaming(
+                update.message, context,
+                stream_about_movie(movie.get('title', 'unknown'), user_question, fallback=fallback, lang=lang),
+            )
+            return CHOOSE_REPEAT
 
-    timeout = aiohttp.ClientTimeout(total=10)
+        response = await ask_about_movie(movie.get('title', 'unknown'), user_question, fallback=fallback, lang=lang)
+    await update.message.reply_text(response)
+    return CHOOSE_REPEAT
 
+async def edit_placeholder(message, text, wait=False):
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(API_URL, headers=headers, json=payload) as resp:
-                if resp.status != 200:
-                    raise Exception(f"Hugging Face API kļūda: {resp.status}")
-                data = await resp.json()
-                if isinstance(data, list) and len(data) > 0 and "generated_text" in data[0]:
-                    return data[0]["generated_text"]
-                return str(data)
-
-    except asyncio.TimeoutError:
-        logger.error("Hugging Face API timeout")
-        return "⏳ Servera atbilde aizkavējās. Pamēģini vēlreiz vēlāk."
-
-    except aiohttp.ClientError as e:
-        logger.error(f"Tīkla kļūda: {e}")
-        return "⚠️ Tīkla kļūda. Lūdzu, mēģini vēlreiz."
+        await message.edit_text(text)
+        return True
+    except RetryAfter as e:
+        logger.warning(f"Telegram edit rate limit: {e.retry_after}s")
+        # промежуточную правку просто пропускаем, а финальную дождёмся
+        if wait:
+            await asyncio.sleep(e.retry_after)
+            return await edit_placeholder(message, text)
+    except BadRequest as e:
+        # "Message is not modified" и т.п. — не повод ронять ответ
+        logger.warning(f"Edit failed: {e}")
+    return False
+
+async def reply_streaming(message, context, chunks):
+    await context.bot.send_chat_action(chat_id=message.chat_id, action=ChatAction.TYPING)
+    placeholder = await message.reply_text(AI_PLACEHOLDER)
+
+    loop = asyncio.get_running_loop()
+    shown = AI_PLACEHOLDER
+    last_edit = loop.time()
+    text = ""
+    async for text in chunks:
+        now = loop.time()
+        if now - last_edit >= AI_EDIT_INTERVAL and text + " …" != shown:
+            if await edit_placeholder(placeholder, text + " …"):
+                shown = text + " …"
+            last_edit = now
+
+    if text and text != shown:
+        await edit_placeholder(placeholder, text, wait=True)
 
-    except Exception as e:
-        logger.error(f"Negaidīta kļūda: {e}")
-        return "⚠️ Negaidīta kļūda. Lūdzu, mēģini vēlreiz."
 
 # Показываем выбор языка (по команде /language)
 async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         get_text("choose_language", DEFAULT_LANGUAGE),
-        reply_markup=ReplyKeyboardMarkup(
-            [[lang] for lang in LANGUAGES]+ [["/cancel"]], one_time_keyboard=True, resize_keyboard=True
-        ),
+        reply_markup=keyboard("language", DEFAULT_LANGUAGE),
     )
     return LANG_SELECTION
 
-history_lock = asyncio.Lock()
-
-async def load_history():
-    async with history_lock:
-        try:
-            if not os.path.exists(HISTORY_FILE):
-                with open(HISTORY_FILE, 'w') as f:
-                    json.dump({}, f)
-            with open(HISTORY_FILE, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Cannot load history: {e}")
-            return {}
-
-async def save_history(data):
-    async with history_lock:
-        try:
-            with open(HISTORY_FILE, 'w') as f:
-                json.dump(data, f, indent=2)
-        except Exception as e:
-            logger.error(f"History save failed: {e}")    
+history_store = None
+history_writer = None
+
+def history_item(movie, context):
+    return {
+        "title": movie.get("title", "Unknown"),
+        "year": movie.get("year", "----"),
+        "url": movie.get("trakt_url", ""),
+        "people": context.user_data.get("people"),
+        "genre": context.user_data.get("genre"),
+        "time": context.user_data.get("time", ""),
+        "min_rating": context.user_data.get("min_rating", 0),
+    }
 
-def main():
-    logger.info("Запуск бота...")
+def add_history(user_id, movie, context):
+    # Не ждём диска: запись уйдёт в базу фоновой пачкой
+    history_writer.add(user_id, history_item(movie, context))
+    seen = context.user_data.get("seen")
+    if seen is not None:
+        remember_seen(seen, movie_key(movie))
+    taste = context.user_data.get("taste")
+    if taste is not None and personalization.enabled():
+        personalization.update_taste(taste, movie)
+
+async def get_recent_history(user_id, limit=5):
+    try:
+        with stage_latency.time(stage="history_load"):
+            saved = await asyncio.to_thread(history_store.last, str(user_id), limit)
+    except Exception as e:
+        logger.error(f"Cannot load history: {e}")
+        saved = []
+    return (saved + history_writer.pending_for(user_id))[-limit:]
+
+async def open_history_store():
+    global history_store, history_writer
+    history_store = await asyncio.to_thread(HistoryStore, HISTORY_DB)
+    if WORKER_ID is None:
+        await asyncio.to_thread(migrate_history_json)
+    history_writer = HistoryWriter(history_store, HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL)
+    history_writer.start()
+
+def migrate_history_json():
+    """Перенос user_history.json; с воркерами его делает фронт один раз до их запуска."""
+    store = history_store or HistoryStore(HISTORY_DB)
+    try:
+        store.migrate_json(HISTORY_FILE)
+    except Exception as e:
+        logger.error(f"History migration failed: {e}")
+    finally:
+        if store is not history_store:
+            store.close()
+
+async def close_history_store():
+    if history_writer is not None:
+        await history_writer.stop()
+    if history_store is not None:
+        history_store.close()
+
+# Метки для tracked(): вход в диалог (/start, /language) и fallback, сработавший из любого шага
+ENTRY = "ENTRY"
+FALLBACK = "FALLBACK"
+
+STATE_NAMES = {
+    CHOOSE_PEOPLE: "CHOOSE_PEOPLE",
+    CHOOSE_GENRE: "CHOOSE_GENRE",
+    CHOOSE_TIME: "CHOOSE_TIME",
+    CHOOSE_RATING: "CHOOSE_RATING",
+    CHOOSE_REPEAT: "CHOOSE_REPEAT",
+    WAITING_QUESTION: "WAITING_QUESTION",
+    LANG_SELECTION: "LANG_SELECTION",
+    ConversationHandler.END: "END",
+}
 
-    app = ApplicationBuilder().token(TG_BOT_TOKEN).build()
+def tracked(state, callback):
+    """Оборачивает хендлер состояния, чтобы считать переходы state -> новое состояние."""
+    async def wrapper(update, context):
+        new_state = await callback(update, context)
+        transitions.inc(
+            from_state=STATE_NAMES.get(state, str(state)),
+            to_state=STATE_NAMES.get(new_state, "SAME" if new_state is None else str(new_state)),
+        )
+        return new_state
+    return wrapper
+
+async def on_startup(app):
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_LISTEN, int(METRICS_PORT))
+    await start_trakt_client()
+    await start_hf_client(HF_API_TOKEN)
+    start_catalog_builder(GENRE_EMOJIS.values())
+    await open_history_store()
+
+async def on_shutdown(app):
+    logger.info(f"Trakt cache: {cache_stats()}")
+    logger.info(f"AI cache: {hf_stats()}")
+    await close_history_store()
+    await close_trakt_client()
+    await close_hf_client()
+    await stop_metrics_server()
+
+def build_application(base_url=TG_API_URL):
+    builder = (
+        ApplicationBuilder()
+        .token(TG_BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    )
+    if STATE_DB:
+        builder = builder.persistence(SqlitePersistence(
+            STATE_DB, update_interval=PERSISTENCE_INTERVAL, idle_ttl=PERSISTENCE_IDLE_TTL,
+        ))
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
 
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
+        entry_points=[
+            CommandHandler("start", tracked(ENTRY, start)),
+            CommandHandler("language", tracked(ENTRY, set_language)),
+        ],
         states={
-            LANG_SELECTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_language)],
-            CHOOSE_PEOPLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_people)],
-            CHOOSE_GENRE: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_genre)],
-            CHOOSE_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_time)],
-            CHOOSE_RATING: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_rating)],
-            CHOOSE_REPEAT: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_repeat)],
-            WAITING_QUESTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_ai_question)],
+            LANG_SELECTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(LANG_SELECTION, choose_language))],
+            CHOOSE_PEOPLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(CHOOSE_PEOPLE, choose_people))],
+            CHOOSE_GENRE: [MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(CHOOSE_GENRE, choose_genre))],
+            CHOOSE_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(CHOOSE_TIME, choose_time))],
+            CHOOSE_RATING: [MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(CHOOSE_RATING, choose_rating))],
+            CHOOSE_REPEAT: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(CHOOSE_REPEAT, choose_repeat)),
+                # кнопки под фильмом: иначе "Ask AI" не переводит диалог в WAITING_QUESTION
+                CallbackQueryHandler(tracked(CHOOSE_REPEAT, button_callback)),
+            ],
+            WAITING_QUESTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(WAITING_QUESTION, handle_ai_question))],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        # /language работает из любого шага: ответ на него ловит LANG_SELECTION
+        fallbacks=[
+            CommandHandler("cancel", tracked(FALLBACK, cancel)),
+            CommandHandler("language", tracked(FALLBACK, set_language)),
+        ],
+        name="meowie",
+        persistent=bool(STATE_DB),
     )
 
     app.add_handler(conv_handler)
     app.add_handler(CommandHandler("cancel", cancel))
-    app.add_handler(CommandHandler("language", set_language))
     app.add_handler(CommandHandler("history", history))
     app.add_handler(CallbackQueryHandler(button_callback))
+    return app
+
+def main():
+    if WORKER_ID is None and WORKERS > 1:
+        logger.info(f"Запуск фронта на {WORKERS} воркеров...")
+        migrate_history_json()
+        asyncio.run(run_dispatcher(
+            TG_BOT_TOKEN,
+            WORKERS,
+            WORKER_BASE_PORT,
+            path=WEBHOOK_PATH,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            base_url=TG_API_URL,
+        ))
+        return
+
+    logger.info("Запуск бота...")
+
+    app = build_application()
+
+    if WORKER_ID is not None:
+        # воркер: апдейты приходят только от фронта, с Telegram он лишь отправляет ответы
+        logger.info(f"Darbinieks {WORKER_ID} klausās 127.0.0.1:{WORKER_PORT}")
+        asyncio.run(serve_webhook(
+            app,
+            listen="127.0.0.1",
+            port=WORKER_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WORKER_SECRET,
+        ))
+        return
 
     print("Meowie ieskrējis čatā!")
-    app.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(serve_webhook(
+            app,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+        ))
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,166 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("catalog_store")
+
+
+class CatalogStore:
+    """
+    Локальный каталог фильмов в SQLite. Trakt-слой пишет сюда каждый удачный
+    ответ, а при старте или недоступности API кэш читает отсюда.
+    Методы синхронные — из async-кода их вызываем через asyncio.to_thread.
+    """
+
+    def __init__(self, path="catalog.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS genres (
+                genre TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS movies (
+                genre TEXT NOT NULL,
+                slug TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (genre, slug)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS posters (
+                movie TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def load_genre(self, genre):
+        """Возвращает (movies, fetched_at) или None, если жанра ещё нет."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at FROM genres WHERE genre = ?", (genre,)
+            ).fetchone()
+            if row is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT data FROM movies WHERE genre = ? ORDER BY position", (genre,)
+            ).fetchall()
+        movies = [json.loads(data) for (data,) in rows]
+        return (movies, row[0]) if movies else None
+
+    def _write_genre(self, genre, movies, fetched_at):
+        rows = [
+            (genre, movie["trakt_url"].rsplit("/", 1)[-1], i, json.dumps(movie, ensure_ascii=False))
+            for i, movie in enumerate(movies)
+        ]
+        self._conn.execute("DELETE FROM movies WHERE genre = ?", (genre,))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO movies (genre, slug, position, data) VALUES (?, ?, ?, ?)", rows
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO genres (genre, fetched_at) VALUES (?, ?)",
+            (genre, time.time() if fetched_at is None else fetched_at),
+        )
+
+    def save_genre(self, genre, movies, fetched_at=None):
+        with self._lock, self._conn:
+            self._write_genre(genre, movies, fetched_at)
+
+    def update_genre(self, genre, update, fetched_at=None):
+        """
+        Читает сохранённый список жанра, пишет update(список) и возвращает результат.
+        BEGIN IMMEDIATE сразу берёт замок на запись, поэтому save_genre другого
+        процесса не может вклиниться между чтением и записью и потеряться.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT data FROM movies WHERE genre = ? ORDER BY position", (genre,)
+                ).fetchall()
+                movies = update([json.loads(data) for (data,) in rows])
+                self._write_genre(genre, movies, fetched_at)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return movies
+
+    def genre_fetched_at(self, genre):
+        with self._lock:
+            row = self._conn.execute("SELECT fetched_at FROM genres WHERE genre = ?", (genre,)).fetchone()
+        return row[0] if row else None
+
+    def acquire_lease(self, name, owner, ttl):
+        """
+        Межпроцессный замок на ttl секунд: True, если он свободен, просрочен или уже наш.
+        Одна UPSERT-инструкция, поэтому два процесса не могут взять его одновременно.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.expires_at < ? OR leases.owner = excluded.owner
+                """,
+                (name, owner, now + ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def lease_held(self, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM leases WHERE name = ? AND expires_at >= ?", (name, time.time())
+            ).fetchone()
+        return row is not None
+
+    def release_lease(self, name, owner):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def poster_file_ids(self):
+        """Все сохранённые Telegram file_id постеров: {ключ фильма: file_id}."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT movie, file_id FROM posters"))
+
+    def save_poster(self, movie, file_id):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO posters (movie, file_id) VALUES (?, ?)", (movie, file_id)
+            )
+
+    def delete_poster(self, movie):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM posters WHERE movie = ?", (movie,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
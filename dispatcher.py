@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import sys
+
+import aiohttp
+from aiohttp import web
+from telegram import Bot, Update
+
+logger = logging.getLogger("dispatcher")
+
+# Сколько ждём, пока воркер (пере)запустится, прежде чем потерять апдейт
+FORWARD_TIMEOUT = float(os.getenv("WORKER_FORWARD_TIMEOUT", "60"))
+RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "1.0"))
+
+
+def shard_key(data):
+    """Ключ шардирования по сырому JSON апдейта: пользователь, а если его нет — чат."""
+    for field in ("message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+                  "my_chat_member", "chat_member", "chat_join_request", "poll_answer", "pre_checkout_query",
+                  "shipping_query"):
+        payload = data.get(field)
+        if not isinstance(payload, dict):
+            continue
+        user = payload.get("from") or payload.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+class Dispatcher:
+    """
+    Фронт для нескольких процессов бота. Апдейт уходит воркеру номер
+    user_id % workers, поэтому все апдейты пользователя (его user_data, состояние
+    диалога, лимиты) живут в одном процессе, а PerChatUpdateProcessor в нём
+    сохраняет порядок. Сюда же апдейты пользователя пересылаются строго по
+    очереди: следующий уходит только после того, как воркер принял предыдущий.
+    Воркеры — обычные `python bot.py` с WORKER_ID/WORKER_PORT, слушают
+    127.0.0.1 и перезапускаются, если упали. Каталог, история и состояние —
+    общие SQLite-файлы (WAL), а походы в Trakt между процессами координирует
+    lease в catalog_store.
+    """
+
+    def __init__(self, workers, base_port, path="/telegram", command=None, env=None):
+        self.workers = workers
+        self.base_port = base_port
+        self.path = path
+        self.command = command or [sys.executable, os.path.abspath(sys.argv[0])]
+        self.env = dict(os.environ if env is None else env)
+        self.secret = secrets.token_urlsafe(24)
+        self.stats = {"forwarded": 0, "retries": 0, "dropped": 0, "rejected": 0, "restarts": 0}
+        self._processes = [None] * workers
+        self._supervisors = []
+        self._locks = {}  # key -> [asyncio.Lock, сколько апдейтов ждут/пересылаются]
+        self._session = None
+        self._stopping = False
+
+    def shard(self, data):
+        key = shard_key(data)
+        return 0 if key is None else key % self.workers
+
+    def worker_url(self, index):
+        return f"http://127.0.0.1:{self.base_port + index}{self.path}"
+
+    def _worker_env(self, index):
+        env = dict(self.env)
+        env.update({
+            "WORKER_ID": str(index),
+            "WORKER_PORT": str(self.base_port + index),
+            "WORKER_SECRET": self.secret,
+        })
+        # у каждого воркера свой /metrics: METRICS_PORT, METRICS_PORT + 1, ...
+        if env.get("METRICS_PORT"):
+            env["METRICS_PORT"] = str(int(env["METRICS_PORT"]) + index)
+        return env
+
+    async def _spawn(self, index):
+        process = await asyncio.create_subprocess_exec(*self.command, env=self._worker_env(index))
+        self._processes[index] = process
+        logger.info(f"Palaists darbinieks {index} (pid {process.pid}, ports {self.base_port + index})")
+        return process
+
+    async def _supervise(self, index):
+        while not self._stopping:
+            process = await self._spawn(index)
+            code = await process.wait()
+            if self._stopping:
+                return
+            self.stats["restarts"] += 1
+            logger.error(f"Darbinieks {index} apstājās ar kodu {code}, palaižam vēlreiz")
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        self._supervisors = [asyncio.create_task(self._supervise(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        self._stopping = True
+        for process in self._processes:
+            if process is not None and process.returncode is None:
+                process.terminate()
+        for process in self._processes:
+            if process is None:
+                continue
+            try:
+                await asyncio.wait_for(process.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        for task in self._supervisors:
+            task.cancel()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+        logger.info(f"Dispečers apstājies: {self.stats}")
+
+    async def _post(self, index, data):
+        """
+        Отдаёт апдейт воркеру; пока тот стартует или перезапускается (нет
+        соединения, 5xx) — повторяет. 4xx — сам апдейт плохой (400) или чужой
+        секрет (403): повтор не поможет, а очередь пользователя простоит зря,
+        поэтому такой апдейт сразу отбрасываем. False — только если воркер
+        так и не стал доступен: тогда пусть Telegram пришлёт апдейт ещё раз.
+        """
+        deadline = asyncio.get_running_loop().time() + FORWARD_TIMEOUT
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.secret}
+        while True:
+            try:
+                async with self._session.post(self.worker_url(index), json=data, headers=headers) as resp:
+                    if resp.status == 200:
+                        self.stats["forwarded"] += 1
+                        return True
+                    logger.error(f"Darbinieks {index} atbildēja {resp.status}")
+                    if 400 <= resp.status < 500:
+                        self.stats["rejected"] += 1
+                        return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if asyncio.get_running_loop().time() >= deadline:
+                    logger.error(f"Darbinieks {index} nav pieejams: {e}")
+            if self._stopping or asyncio.get_running_loop().time() >= deadline:
+                self.stats["dropped"] += 1
+                return False
+            self.stats["retries"] += 1
+            await asyncio.sleep(0.2)
+
+    async def forward(self, data):
+        key = shard_key(data)
+        index = 0 if key is None else key % self.workers
+        if key is None:
+            return await self._post(index, data)
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._post(index, data)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+def make_front_app(dispatcher, path="/telegram", secret_token=None):
+    """Публичный webhook: принимает апдейт от Telegram и пересылает его нужному воркеру."""
+
+    async def handle_update(request):
+        if secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        # 200 только после того, как воркер принял апдейт, иначе Telegram повторит его сам
+        if not await dispatcher.forward(data):
+            return web.Response(status=503)
+        return web.Response()
+
+    web_app = web.Application()
+    web_app.router.add_post(path, handle_update)
+    return web_app
+
+
+async def poll_updates(dispatcher, bot, stop_event, timeout=30):
+    """Long polling в одном месте: getUpdates делает только фронт, воркеры его не вызывают."""
+    await bot.delete_webhook()
+    offset = None
+    while not stop_event.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=Update.ALL_TYPES)
+        except Exception as e:
+            logger.error(f"getUpdates kļūda: {e}")
+            await asyncio.sleep(1)
+            continue
+        if not updates:
+            continue
+        # задачи создаются по порядку, а замок на пользователя честный (FIFO) —
+        # порядок апдейтов каждого пользователя сохраняется
+        await asyncio.gather(*[dispatcher.forward(update.to_dict()) for update in updates])
+        offset = updates[-1].update_id + 1
+
+
+async def run_dispatcher(token, workers, base_port, path="/telegram", listen="0.0.0.0", port=8443,
+                         webhook_url=None, secret_token=None, stop_event=None, base_url=None):
+    """
+    Запускает воркеров и принимает апдейты: через свой webhook, если задан
+    webhook_url, иначе long polling. Работает до SIGINT/SIGTERM (или stop_event).
+    """
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+    dispatcher = Dispatcher(workers, base_port, path)
+    await dispatcher.start()
+    bot = Bot(token, base_url=base_url) if base_url else Bot(token)
+    runner = None
+    try:
+        async with bot:
+            if webhook_url:
+                runner = web.AppRunner(make_front_app(dispatcher, path, secret_token))
+                await runner.setup()
+                await web.TCPSite(runner, listen, port).start()
+                await bot.set_webhook(
+                    url=webhook_url.rstrip("/") + path,
+                    secret_token=secret_token,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                logger.info(f"Dispečers klausās {listen}:{port}{path}, darbinieki: {workers}")
+                await stop_event.wait()
+            else:
+                logger.info(f"Dispečers saņem atjauninājumus ar long polling, darbinieki: {workers}")
+                polling = asyncio.create_task(poll_updates(dispatcher, bot, stop_event))
+                await stop_event.wait()
+                polling.cancel()
+                await asyncio.gather(polling, return_exceptions=True)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        await dispatcher.stop()
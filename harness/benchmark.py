@@ -0,0 +1,290 @@
+"""
+Офлайн-бенчмарк горячих путей бота: поднимает FakeTelegram, FakeTrakt и FakeHF
+на localhost, проводит множество пользователей через весь диалог
+(/start → люди → жанр → время → рейтинг → ещё фильм → Ask AI → вопрос)
+и печатает пропускную способность, p50/p99 латентность хендлеров по шагам
+и самые долгие одиночные колбэки event loop. Сеть не нужна — можно гонять в CI:
+
+    python -m harness.benchmark --users 2000 --concurrency 200
+    python -m harness.benchmark --users 500 --trakt-errors 0.05 --max-p99 0.5 --max-stall 0.25
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from harness.fake_hf import FakeHF
+from harness.fake_telegram import FakeTelegram, callback_update, text_update
+from harness.fake_trakt import FakeTrakt
+
+for key, value in {
+    "TG_BOT_TOKEN": "123456:benchmark",
+    "HF_API_TOKEN": "benchmark",
+    "TRAKT_CLIENT_ID": "benchmark",
+    "CATALOG_DB": ":memory:",
+    "HISTORY_DB": ":memory:",
+    "STATE_DB": ":memory:",
+    "TRAKT_DEEP_PAGES": "0",
+    "METRICS_PORT": "",
+}.items():
+    os.environ.setdefault(key, value)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PEOPLE = ["Viens", "Kopā"]
+RATINGS = ["5+", "6+", "7+"]
+# Первый вопрос закрывает local_answers, второй уходит в модель
+QUESTIONS = ["Cik ilgi tā ir?", "Kas ir režisors?"]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def describe_callback(handle):
+    """
+    Для шага задачи — имя задачи и самая внутренняя корутина с местом, где шаг
+    закончился (долгий код — прямо перед этим await); для прочего — repr.
+    """
+    task = getattr(getattr(handle, "_callback", None), "__self__", None)
+    if not isinstance(task, asyncio.Task):
+        return repr(handle)
+    coro = task.get_coro()
+    name, where = getattr(coro, "__qualname__", repr(coro)), "pabeigts"
+    # идём по цепочке await вглубь и берём последнюю корутину из файлов бота
+    while getattr(coro, "cr_frame", None) is not None:
+        filename = coro.cr_frame.f_code.co_filename
+        if filename.startswith(ROOT):
+            name, where = coro.__qualname__, f"{os.path.relpath(filename, ROOT)}:{coro.cr_frame.f_lineno}"
+        coro = coro.cr_await
+    return f"{task.get_name()} {name} ({where})"
+
+
+class LoopMonitor:
+    """
+    Меряет длительность каждого отдельного колбэка event loop (шаг корутины,
+    call_soon, таймер) — обёртка над asyncio.Handle._run на время прогона.
+    Поздние пробуждения под нагрузкой — это очередь из множества коротких
+    колбэков, а не блокировка; loop блокирует только долгий одиночный колбэк,
+    поэтому считаем колбэки дольше threshold и запоминаем самые медленные.
+    """
+
+    def __init__(self, threshold=0.05, keep=5):
+        self.threshold = threshold
+        self.keep = keep
+        self.callbacks = 0
+        self.stalls = []  # (длительность, repr колбэка)
+        self._original = None
+
+    def start(self):
+        original = self._original = asyncio.events.Handle._run
+        monitor = self
+
+        def timed_run(handle):
+            started = time.perf_counter()
+            try:
+                return original(handle)
+            finally:
+                elapsed = time.perf_counter() - started
+                monitor.callbacks += 1
+                if elapsed > monitor.threshold:
+                    monitor.stalls.append((elapsed, describe_callback(handle)))
+
+        asyncio.events.Handle._run = timed_run
+
+    async def stop(self):
+        if self._original is not None:
+            asyncio.events.Handle._run = self._original
+            self._original = None
+
+    def report(self):
+        slowest = sorted(self.stalls, reverse=True)[:self.keep]
+        return {
+            "callbacks": self.callbacks,
+            "threshold_s": self.threshold,
+            "stalls": len(self.stalls),
+            "stalled_s": sum(elapsed for elapsed, _ in self.stalls),
+            "max_stall_s": slowest[0][0] if slowest else 0.0,
+            "slowest": [{"seconds": elapsed, "callback": callback[:200]} for elapsed, callback in slowest],
+        }
+
+
+def user_steps(bot, uid):
+    """Шаги одного пользователя по порядку: (имя шага, JSON апдейта)."""
+    genres = list(bot.GENRE_EMOJIS)
+    lang = bot.DEFAULT_LANGUAGE
+    return [
+        ("start", text_update(uid, "/start")),
+        ("people", text_update(uid, PEOPLE[uid % len(PEOPLE)])),
+        ("genre", text_update(uid, genres[uid % len(genres)])),
+        ("time", text_update(uid, bot.TIME_EMOJIS[uid % len(bot.TIME_EMOJIS)])),
+        ("rating", text_update(uid, RATINGS[uid % len(RATINGS)])),
+        ("repeat", text_update(uid, bot.get_text("repeat_option", lang))),
+        ("ask_ai", callback_update(uid, "ask_ai")),
+        ("question", text_update(uid, QUESTIONS[uid % len(QUESTIONS)])),
+    ]
+
+
+async def run(users=1000, concurrency=100, telegram_latency=0.0, trakt_latency=0.02,
+              trakt_errors=0.0, hf_latency=0.05, hf_errors=0.0, abusers=0, abuse_taps=200, stall_threshold=0.05):
+    from telegram import Update
+
+    telegram = await FakeTelegram(latency=telegram_latency).start()
+    trakt = await FakeTrakt(latency=trakt_latency, error_rate=trakt_errors).start()
+    hf = await FakeHF(latency=hf_latency, error_rate=hf_errors).start()
+    os.environ["TRAKT_API_URL"] = trakt.base_url
+
+    import bot
+    import hf_client
+    # hf_client уже импортирован вместе с FakeHF, поэтому адрес ставим напрямую
+    hf_client.HF_API_URL = hf.url
+    from metrics import fallbacks
+    from trakt_recommendation import cache_stats
+    from hf_client import hf_stats
+
+    app = bot.build_application(base_url=telegram.base_url)
+    await app.initialize()
+    await app.post_init(app)
+
+    latencies = {}
+    failures = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def send(uid, step, data):
+        update = Update.de_json(data, app.bot)
+        started = time.perf_counter()
+        try:
+            await app.process_update(update)
+        except Exception as e:
+            failures.append((uid, step, repr(e)))
+            return False
+        latencies.setdefault(step, []).append(time.perf_counter() - started)
+        return True
+
+    async def drive(uid):
+        async with limit:
+            for step, data in user_steps(bot, uid):
+                if not await send(uid, step, data):
+                    return
+
+    async def abuse(uid):
+        # "скрипт", который без пауз жмёт "ещё фильм" поверх обычных пользователей
+        for step, data in user_steps(bot, uid)[:5]:
+            await send(uid, step, data)
+        for _ in range(abuse_taps):
+            await send(uid, "abuse", callback_update(uid, "repeat_movie"))
+
+    monitor = LoopMonitor(stall_threshold)
+    monitor.start()
+    user_ids = range(1000, 1000 + users)
+    started = time.perf_counter()
+    abuser_ids = range(1, 1 + abusers)
+    await asyncio.gather(*[drive(uid) for uid in user_ids], *[abuse(uid) for uid in abuser_ids])
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+
+    await app.shutdown()
+    await app.post_shutdown(app)
+    for server in (telegram, trakt, hf):
+        await server.stop()
+
+    steps = len(user_steps(bot, 0))
+    incomplete = [uid for uid in user_ids if len(telegram.sent_to(uid)) < steps]
+    everything = [value for step, values in latencies.items() if step != "abuse" for value in values]
+    result = {
+        "users": users,
+        "updates": len(everything),
+        "elapsed_s": elapsed,
+        "updates_per_s": len(everything) / elapsed if elapsed else 0.0,
+        "p50_s": percentile(everything, 0.5),
+        "p99_s": percentile(everything, 0.99),
+        "steps": {
+            step: {"p50_s": percentile(values, 0.5), "p99_s": percentile(values, 0.99), "max_s": max(values)}
+            for step, values in latencies.items()
+        },
+        "loop": monitor.report(),
+        "failures": len(failures),
+        "incomplete_users": len(incomplete),
+        "not_found": fallbacks.get(kind="not_found"),
+        "rate_limit": dict(bot.rate_limiter.stats),
+        "trakt_requests": trakt.requests,
+        "hf_requests": hf.requests,
+        "hf_prompts": hf.prompts,
+        "genre_cache": cache_stats(),
+        "ai_cache": hf_stats(),
+    }
+    for uid, step, error in failures[:5]:
+        print(f"Kļūda: lietotājs {uid}, solis {step}: {error}")
+    return result
+
+
+def print_report(result):
+    print(f"{result['users']} lietotāji, {result['updates']} atjauninājumi: "
+          f"{result['elapsed_s']:.2f} s ({result['updates_per_s']:.0f} upd/s)")
+    print(f"Latentums: p50 {result['p50_s'] * 1000:.1f} ms, p99 {result['p99_s'] * 1000:.1f} ms")
+    for step, stats in result["steps"].items():
+        print(f"  {step:<9} p50 {stats['p50_s'] * 1000:7.1f} ms   p99 {stats['p99_s'] * 1000:7.1f} ms   "
+              f"max {stats['max_s'] * 1000:7.1f} ms")
+    loop = result["loop"]
+    print(f"Event loop: {loop['stalls']} no {loop['callbacks']} izsaukumiem ilgāk par "
+          f"{loop['threshold_s'] * 1000:.0f} ms (kopā {loop['stalled_s'] * 1000:.0f} ms), "
+          f"garākais {loop['max_stall_s'] * 1000:.1f} ms")
+    for stall in loop["slowest"]:
+        print(f"  {stall['seconds'] * 1000:7.1f} ms  {stall['callback']}")
+    print(f"Trakt pieprasījumi: {result['trakt_requests']}, HF pieprasījumi: {result['hf_requests']} "
+          f"({result['hf_prompts']} jautājumi), nav atrasts: {result['not_found']}")
+    print(f"Lietotāju limits: {result['rate_limit']}")
+    print(f"Kļūdas: {result['failures']}, nepabeigti lietotāji: {result['incomplete_users']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="cik lietotāju iet cauri dialogam vienlaikus")
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    parser.add_argument("--trakt-latency", type=float, default=0.02)
+    parser.add_argument("--trakt-errors", type=float, default=0.0, help="kļūdu daļa no 0 līdz 1")
+    parser.add_argument("--hf-latency", type=float, default=0.05)
+    parser.add_argument("--hf-errors", type=float, default=0.0, help="kļūdu daļa no 0 līdz 1")
+    parser.add_argument("--personalized", action="store_true", help="izvēle pēc lietotāja gaumes (PERSONALIZATION=1)")
+    parser.add_argument("--abusers", type=int, default=0, help="lietotāji, kas bez pauzes spiež „vēl filmu”")
+    parser.add_argument("--abuse-taps", type=int, default=200)
+    parser.add_argument("--max-p99", type=float, help="kļūda, ja p99 pārsniedz šo (sekundes)")
+    parser.add_argument("--stall-threshold", type=float, default=0.05,
+                        help="event loop izsaukums, kas ilgāks par šo, skaitās bloķējošs (sekundes)")
+    parser.add_argument("--max-stall", type=float, help="kļūda, ja kāds event loop izsaukums ilgāks (sekundes)")
+    parser.add_argument("--json", help="saglabāt rezultātu JSON failā")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.personalized:
+        os.environ["PERSONALIZATION"] = "1"
+    # bot.py сам вызывает basicConfig(INFO); настраиваем раньше, чтобы логи не мерили вместо бота
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    result = asyncio.run(run(
+        args.users, args.concurrency, args.telegram_latency,
+        args.trakt_latency, args.trakt_errors, args.hf_latency, args.hf_errors,
+        args.abusers, args.abuse_taps, args.stall_threshold,
+    ))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+    ok = not result["failures"] and not result["incomplete_users"]
+    if args.max_p99 is not None and result["p99_s"] > args.max_p99:
+        print(f"p99 {result['p99_s']:.3f} s > {args.max_p99} s")
+        ok = False
+    if args.max_stall is not None and result["loop"]["max_stall_s"] > args.max_stall:
+        print(f"Event loop izsaukums {result['loop']['max_stall_s']:.3f} s > {args.max_stall} s")
+        ok = False
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
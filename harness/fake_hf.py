@@ -0,0 +1,74 @@
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+from hf_client import ScriptedModel
+
+
+def scripted_answer(prompt):
+    film = prompt.partition("\n")[0].removeprefix("Film: ")
+    return f"Meow. A scripted answer about {film or 'this film'}."
+
+
+class FakeHF:
+    """
+    Мини-сервер inference API: отвечает на одиночные и пакетные inputs, а при
+    "stream": true отдаёт токены как server-sent events (их темп задаёт
+    ScriptedModel). latency — задержка перед ответом, error_rate — доля 503.
+    Бот направляется сюда через HF_API_URL=fake.url.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, token_delay=0.005, seed=2):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.model = ScriptedModel(scripted_answer, token_delay)
+        self.requests = 0
+        self.prompts = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._runner = None
+        self.port = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/model"
+
+    async def _handle(self, request):
+        self.requests += 1
+        body = await request.json()
+        inputs = body.get("inputs")
+        self.prompts += len(inputs) if isinstance(inputs, list) else 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": "Model is overloaded"}, status=503)
+
+        if body.get("stream") and isinstance(inputs, str):
+            resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await resp.prepare(request)
+            async for token in self.model.stream(inputs):
+                event = {"token": {"text": token, "special": False}}
+                await resp.write(f"data: {json.dumps(event)}\n\n".encode())
+            await resp.write_eof()
+            return resp
+
+        if isinstance(inputs, list):
+            return web.json_response([[{"generated_text": self.model.answer(p)}] for p in inputs])
+        return web.json_response([{"generated_text": self.model.answer(inputs)}])
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_post("/model", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
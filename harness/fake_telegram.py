@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    """
+    Мини-сервер Bot API для локальных прогонов: отвечает на методы, которые
+    вызывает бот, и запоминает все вызовы в self.calls как (method, params, time).
+    Бот направляется сюда через ApplicationBuilder().base_url(fake.base_url).
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def sent_to(self, chat_id):
+        """Тексты сообщений (и подписи фото), отправленных в чат, по порядку."""
+        return [
+            params.get("text") or params.get("caption") or ""
+            for method, params, _ in self.calls
+            if method in ("sendMessage", "sendPhoto") and str(params.get("chat_id")) == str(chat_id)
+        ]
+
+    def _message(self, params):
+        chat_id = int(params.get("chat_id", 0))
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Meowie", "username": "MeowieBot"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        return message
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        params = {k: v for k, v in params.items() if not hasattr(v, "file")}
+        self.calls.append((method, params, time.monotonic()))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Meowie", "username": "MeowieBot"}
+        elif method in ("sendMessage", "editMessageText", "sendPhoto"):
+            result = self._message(params)
+            if method == "sendPhoto":
+                result["photo"] = [{
+                    "file_id": f"fake-photo-{result['message_id']}",
+                    "file_unique_id": f"u{result['message_id']}",
+                    "width": 300,
+                    "height": 450,
+                }]
+        elif method == "getUpdates":
+            await asyncio.sleep(1)
+            result = []
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result}, dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+_update_ids = itertools.count(1)
+
+
+def text_update(user_id, text):
+    """JSON апдейта с текстовым сообщением от пользователя (команды размечаются entities)."""
+    message = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(user_id, data, message_id=1):
+    """JSON апдейта с нажатием inline-кнопки."""
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "chat_instance": str(user_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "🎬",
+            },
+        },
+    }
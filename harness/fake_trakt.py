@@ -0,0 +1,88 @@
+import asyncio
+import random
+from collections import Counter
+
+from aiohttp import web
+
+GENRES = ["drama", "comedy", "horror", "science-fiction", "action", "romance"]
+CERTIFICATIONS = ["G", "PG", "PG-13", "R"]
+
+
+def trakt_movie(genre, i):
+    """Фильм в формате ответа Trakt /movies/popular?extended=full,images."""
+    return {
+        "title": f"{genre.title()} {i}",
+        "year": 1970 + i % 55,
+        "ids": {"trakt": sum(map(ord, genre)) * 100000 + i, "slug": f"{genre}-{i}"},
+        "overview": f"Fake {genre} movie number {i}.",
+        "rating": 4 + (i * 37 % 60) / 10,
+        "runtime": 75 + i % 90,
+        "certification": CERTIFICATIONS[i % len(CERTIFICATIONS)],
+        "genres": [genre] + ([GENRES[i % len(GENRES)]] if GENRES[i % len(GENRES)] != genre else []),
+        "images": {"poster": [f"walter-r2.trakt.tv/images/movies/{genre}-{i}/posters/thumb/poster.jpg.webp"]},
+    }
+
+
+class FakeTrakt:
+    """
+    Мини-сервер Trakt API: /movies/popular с пагинацией, задержкой latency и
+    долей ошибок error_rate (половина — 500, половина — 429 с Retry-After).
+    deep_latency — добавка к задержке для страниц от 100 фильмов (ими фон
+    собирает глубокий каталог), чтобы пользователи успели раньше сборщика.
+    Бот направляется сюда через TRAKT_API_URL=fake.base_url.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, movies_per_genre=1000, seed=1, deep_latency=0.0):
+        self.latency = latency
+        self.deep_latency = deep_latency
+        self.error_rate = error_rate
+        self.movies_per_genre = movies_per_genre
+        self.requests = 0
+        self.errors = 0
+        self.pages = Counter()  # (жанр, страница, limit) -> сколько раз запрошена
+        self._random = random.Random(seed)
+        self._runner = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def _popular(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            if self._random.random() < 0.5:
+                return web.Response(status=429, headers={"Retry-After": "0"})
+            return web.Response(status=500)
+
+        genre = request.query.get("genres", "drama")
+        page = max(1, int(request.query.get("page", 1)))
+        limit = max(1, int(request.query.get("limit", 10)))
+        self.pages[genre, page, limit] += 1
+        if self.deep_latency and limit >= 100:
+            await asyncio.sleep(self.deep_latency)
+        page_count = max(1, -(-self.movies_per_genre // limit))
+        start = (page - 1) * limit
+        movies = [trakt_movie(genre, i) for i in range(start, min(start + limit, self.movies_per_genre))]
+        return web.json_response(movies, headers={
+            "X-Pagination-Page": str(page),
+            "X-Pagination-Page-Count": str(page_count),
+            "X-Ratelimit": '{"remaining": 1000, "limit": 1000, "period": 300, "until": null}',
+        })
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_get("/movies/popular", self._popular)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
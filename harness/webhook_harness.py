@@ -0,0 +1,130 @@
+"""
+Локальный прогон webhook-режима без сети: поднимает FakeTelegram, запускает
+бота через serve_webhook и шлёт ему поддельные апдейты от многих пользователей
+одновременно. Проверяет, что ответы каждому чату пришли в правильном порядке.
+
+    python -m harness.webhook_harness --users 200
+"""
+import argparse
+import asyncio
+import os
+import socket
+import time
+
+from harness.fake_telegram import FakeTelegram, text_update
+
+for key, value in {
+    "TG_BOT_TOKEN": "123456:harness",
+    "HF_API_TOKEN": "harness",
+    "TRAKT_CLIENT_ID": "harness",
+    "CATALOG_DB": ":memory:",
+    "HISTORY_DB": ":memory:",
+    "STATE_DB": ":memory:",
+    "TRAKT_DEEP_PAGES": "0",
+}.items():
+    os.environ.setdefault(key, value)
+
+FLOW = ["/start", "Viens", "😱", "🌃", "7+"]
+
+
+def fake_movies(genre, count=200):
+    return [
+        {
+            "title": f"{genre.title()} {i}",
+            "year": 1980 + i % 40,
+            "genres": genre,
+            "overview": f"Fake {genre} movie number {i}.",
+            "trakt_url": f"https://trakt.tv/movies/{genre}-{i}",
+            "rating": 5 + (i % 50) / 10,
+            "trakt_id": i,
+            "runtime": 80 + i % 80,
+            "certification": "PG-13",
+        }
+        for i in range(count)
+    ]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise TimeoutError(f"port {port} nav atvērts")
+
+
+async def run(users=50, telegram_latency=0.0):
+    import aiohttp
+
+    import bot
+    from movie_index import GenrePool
+    from trakt_recommendation import genre_cache
+    from webhook import serve_webhook
+
+    for genre in bot.GENRE_EMOJIS.values():
+        genre_cache.put(genre, GenrePool(fake_movies(genre)))
+
+    fake = await FakeTelegram(latency=telegram_latency).start()
+    app = bot.build_application(base_url=fake.base_url)
+    port = free_port()
+    stop = asyncio.Event()
+    server = asyncio.create_task(serve_webhook(app, "127.0.0.1", port, "/telegram", stop_event=stop))
+    await wait_for_port(port)
+
+    url = f"http://127.0.0.1:{port}/telegram"
+    user_ids = range(1000, 1000 + users)
+    started = time.monotonic()
+    async with aiohttp.ClientSession() as session:
+        async def post(update):
+            async with session.post(url, json=update) as resp:
+                assert resp.status == 200, resp.status
+
+        # Все шаги всех пользователей сразу: порядок внутри чата держит PerChatUpdateProcessor
+        for step in FLOW:
+            await asyncio.gather(*[post(text_update(uid, step)) for uid in user_ids])
+
+    expected = len(FLOW) * users
+    while time.monotonic() - started < 60:
+        sent = sum(1 for method, _, _ in fake.calls if method in ("sendMessage", "sendPhoto"))
+        if sent >= expected:
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.monotonic() - started
+
+    stop.set()
+    await server
+    await fake.stop()
+
+    lang = bot.DEFAULT_LANGUAGE
+    prompts = [bot.get_text(key, lang) for key in ("start", "genre_prompt", "time_prompt", "rating_prompt")]
+    broken = []
+    for uid in user_ids:
+        replies = fake.sent_to(uid)
+        if replies[:4] != prompts or len(replies) < 5 or not replies[4].startswith("🎬"):
+            broken.append(uid)
+
+    print(f"{users} lietotāji, {expected} atjauninājumi: {elapsed:.2f} s ({expected / elapsed:.0f} upd/s)")
+    print(f"Secība salauzta: {len(broken)}")
+    return not broken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.users, args.telegram_latency))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
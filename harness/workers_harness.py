@@ -0,0 +1,170 @@
+"""
+Локальный прогон режима с несколькими процессами: поднимает FakeTelegram и
+FakeTrakt, запускает `python bot.py` с WORKERS=N (фронт + N воркеров на общих
+SQLite-файлах во временной папке) и шлёт фронту апдейты многих пользователей
+несколькими заходами. Первый заход успевает раньше фоновой сборки глубокого
+каталога (её страницы FakeTrakt отдаёт медленно), так что в памяти у
+процессов лишь первая страница; следующие — новые пользователи после
+истечения TRAKT_CACHE_TTL, когда жанр обновляет любой из процессов.
+Проверяет, что каждый пользователь получил ответы по порядку, что каждую
+страницу глубокого каталога запросил только один процесс и что обновление
+не урезало каталог на диске.
+
+    python -m harness.workers_harness --workers 4 --users 200
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from harness.fake_telegram import FakeTelegram, text_update
+from harness.fake_trakt import FakeTrakt
+from harness.webhook_harness import FLOW, free_port, wait_for_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENRE = "horror"  # жанр из FLOW
+DEEP_PAGES = 3
+DEEP_LATENCY = 3.0
+# TTL больше времени сборки: до первого обновления процессы держат в памяти только первую страницу
+CACHE_TTL = 10
+REFRESH_ROUNDS = 3
+
+
+def stored_catalog(path, genre):
+    """(сколько фильмов жанра на диске, собран ли глубокий каталог)."""
+    if not os.path.exists(path):
+        return 0, False
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM movies WHERE genre = ?", (genre,)).fetchone()[0]
+        deep = conn.execute("SELECT 1 FROM meta WHERE key = ?", (f"deep:{genre}",)).fetchone() is not None
+    except sqlite3.OperationalError:
+        return 0, False
+    finally:
+        conn.close()
+    return count, deep
+
+
+async def wait_for_replies(telegram, expected, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        sent = sum(1 for method, _, _ in telegram.calls if method in ("sendMessage", "sendPhoto"))
+        if sent >= expected:
+            return
+        await asyncio.sleep(0.05)
+
+
+async def run(workers=4, users=200, trakt_latency=0.05):
+    telegram = await FakeTelegram().start()
+    trakt = await FakeTrakt(latency=trakt_latency, deep_latency=DEEP_LATENCY).start()
+    port = free_port()
+    tmp = tempfile.TemporaryDirectory()
+    env = dict(os.environ)
+    env.update({
+        "TG_BOT_TOKEN": "123456:workers",
+        "HF_API_TOKEN": "workers",
+        "TRAKT_CLIENT_ID": "workers",
+        "TG_API_URL": telegram.base_url,
+        "TRAKT_API_URL": trakt.base_url,
+        "CATALOG_DB": os.path.join(tmp.name, "catalog.db"),
+        "HISTORY_DB": os.path.join(tmp.name, "history.db"),
+        "STATE_DB": os.path.join(tmp.name, "state.db"),
+        "TRAKT_DEEP_PAGES": str(DEEP_PAGES),
+        "TRAKT_CACHE_TTL": str(CACHE_TTL),
+        "METRICS_PORT": "",
+        "WORKERS": str(workers),
+        "WORKER_BASE_PORT": str(free_port()),
+        "WEBHOOK_URL": "http://127.0.0.1",
+        "WEBHOOK_LISTEN": "127.0.0.1",
+        "PORT": str(port),
+    })
+    front = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "bot.py"), env=env, cwd=tmp.name)
+    await wait_for_port(port, timeout=30)
+
+    url = f"http://127.0.0.1:{port}/telegram"
+    catalog = env["CATALOG_DB"]
+    user_ids = range(1000, 1000 + users)
+    started = time.monotonic()
+    async with aiohttp.ClientSession() as session:
+        async def post(update):
+            async with session.post(url, json=update) as resp:
+                assert resp.status == 200, resp.status
+
+        async def round_trip(uids, expected):
+            # все пользователи одновременно: жанр первыми запрашивают сразу несколько процессов
+            for step in FLOW:
+                await asyncio.gather(*[post(text_update(uid, step)) for uid in uids])
+            await wait_for_replies(telegram, expected)
+
+        # подряд идущие id, чтобы в каждом заходе были пользователи всех воркеров (шард — id % workers)
+        size = -(-users // (REFRESH_ROUNDS + 1))
+        groups = [user_ids[i:i + size] for i in range(0, users, size)]
+        answered = 0
+        await round_trip(groups[0], answered + len(FLOW) * len(groups[0]))
+        answered += len(FLOW) * len(groups[0])
+        refreshed_at = time.monotonic()
+        deadline = time.monotonic() + 60
+        while not stored_catalog(catalog, GENRE)[1] and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        deep_size = stored_catalog(catalog, GENRE)[0]
+        sizes = []
+
+        async def sample():
+            # урезанный каталог может тут же перезаписать сборщик — смотрим на диск постоянно
+            while True:
+                sizes.append(stored_catalog(catalog, GENRE)[0])
+                await asyncio.sleep(0.05)
+
+        sampler = asyncio.create_task(sample())
+        for group in groups[1:]:
+            await asyncio.sleep(max(0.0, refreshed_at + CACHE_TTL + 0.5 - time.monotonic()))
+            await round_trip(group, answered + len(FLOW) * len(group))
+            answered += len(FLOW) * len(group)
+            refreshed_at = time.monotonic()
+        # фоновое обновление пишет каталог уже после ответа пользователю
+        await asyncio.sleep(1)
+        sampler.cancel()
+
+    expected = len(FLOW) * users
+    elapsed = time.monotonic() - started
+
+    front.terminate()
+    await front.wait()
+    await telegram.stop()
+    await trakt.stop()
+    tmp.cleanup()
+
+    broken = [uid for uid in user_ids if len(telegram.sent_to(uid)) < len(FLOW)
+              or not telegram.sent_to(uid)[len(FLOW) - 1].startswith("🎬")]
+    # страницы глубокого каталога (по 100) — строго по разу; первая страница по 50
+    # законно запрашивается заново после каждого TTL
+    doubled = {key: count for key, count in trakt.pages.items() if key[2] == 100 and count > 1}
+    refreshes = sum(count for key, count in trakt.pages.items() if key[0] == GENRE and key[2] == 50)
+    shrunk = deep_size == 0 or min(sizes) < deep_size
+    print(f"{workers} darbinieki, {users} lietotāji, {expected} atjauninājumi: "
+          f"{elapsed:.2f} s ({expected / elapsed:.0f} upd/s)")
+    print(f"Trakt pieprasījumi: {trakt.requests}, {GENRE} 1. lapa: {refreshes} reizes, "
+          f"atkārtoti ielādētas kataloga lapas: {doubled or 'nav'}")
+    print(f"Katalogs uz diska ({GENRE}): {deep_size} pēc kataloga veidošanas, "
+          f"atjauninot mazākais {min(sizes, default=0)}")
+    print(f"Nepabeigti vai salauzti lietotāji: {len(broken)}")
+    return not broken and not doubled and not shrunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--trakt-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.workers, args.users, args.trakt_latency))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
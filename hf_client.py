@@ -0,0 +1,368 @@
+import asyncio
+import json
+import logging
+import os
+import re
+
+import aiohttp
+
+from localization import DEFAULT_LANGUAGE, get_text
+from movie_cache import LRUCache
+from metrics import stage_latency, fallbacks, register_collector
+
+logger = logging.getLogger("hf_client")
+
+HF_API_URL = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models/google/flan-t5-large")
+HF_TIMEOUT = float(os.getenv("HF_TIMEOUT", "10"))
+HF_MAX_CONCURRENCY = int(os.getenv("HF_MAX_CONCURRENCY", "4"))
+# Сколько вопросов может ждать свободного слота; остальным сразу отвечаем "занято"
+HF_MAX_QUEUE = int(os.getenv("HF_MAX_QUEUE", "32"))
+HF_CACHE_SIZE = int(os.getenv("HF_CACHE_SIZE", "2000"))
+HF_CACHE_TTL = float(os.getenv("HF_CACHE_TTL", "86400"))
+# Микро-батчинг: ждём до HF_BATCH_WAIT_MS или HF_BATCH_SIZE вопросов и шлём одним запросом
+HF_BATCH_SIZE = int(os.getenv("HF_BATCH_SIZE", "8"))
+HF_BATCH_WAIT = float(os.getenv("HF_BATCH_WAIT_MS", "20")) / 1000
+# Если есть запасной ответ, дольше этого модель не ждём (она досчитает в фоне в кэш)
+HF_FALLBACK_AFTER = float(os.getenv("HF_FALLBACK_AFTER", "4"))
+
+
+class HFBusyError(Exception):
+    pass
+
+
+class HFBatchRejected(Exception):
+    pass
+
+
+# На эти коды API отвергает сами входные данные — только тогда есть смысл
+# дробить пачку; 429/5xx (перегрузка, модель грузится) дробление лишь умножит
+BATCH_REJECTED_STATUSES = (400, 422)
+
+
+class PromptBatcher:
+    """
+    Собирает промпты, пришедшие почти одновременно, в одну пачку и отдаёт
+    её send_batch(prompts) -> [ответ или Exception для каждого промпта].
+    Каждый вызывающий ждёт свой future, поэтому ошибка одного элемента
+    не задевает остальные.
+    """
+
+    def __init__(self, send_batch, max_size=8, max_wait=0.02):
+        self._send_batch = send_batch
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self._queue = []
+        self._timer = None
+        self.stats = {"batches": 0, "prompts": 0}
+
+    def submit(self, prompt):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((prompt, future))
+        if len(self._queue) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            batch, self._queue = self._queue[:self.max_size], self._queue[self.max_size:]
+            asyncio.ensure_future(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        self.stats["batches"] += 1
+        self.stats["prompts"] += len(batch)
+        try:
+            results = await self._send_batch([prompt for prompt, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():  # тот, кто ждал, уже ушёл
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+# Одна сессия на всё приложение (keep-alive к inference API), её открывает
+# и закрывает жизненный цикл бота — start_hf_client / close_hf_client.
+_session = None
+_headers = {}
+_semaphore = None
+_pending = 0
+_inflight = {}
+_batcher = None
+_stream_model = None
+
+answer_cache = LRUCache(HF_CACHE_SIZE, HF_CACHE_TTL)
+
+
+async def start_hf_client(token):
+    global _session, _headers, _semaphore, _batcher
+    if _session is None:
+        _headers = {"Authorization": f"Bearer {token}"}
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=HF_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=HF_MAX_CONCURRENCY, keepalive_timeout=60),
+        )
+        _semaphore = asyncio.Semaphore(HF_MAX_CONCURRENCY)
+        _batcher = PromptBatcher(_post_batch, HF_BATCH_SIZE, HF_BATCH_WAIT)
+    return _session
+
+
+async def close_hf_client():
+    global _session, _semaphore, _batcher
+    if _session is not None:
+        await _session.close()
+    _session = None
+    _semaphore = None
+    _batcher = None
+
+
+def normalize_text(text):
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(text.split())
+
+
+def make_prompt(title, question):
+    return f"Film: {title}\nQuestion: {question}\nAnswer:"
+
+
+def _parse_item(item):
+    if isinstance(item, list) and item:
+        item = item[0]
+    if isinstance(item, dict):
+        if "generated_text" in item:
+            return item["generated_text"]
+        if "error" in item:
+            return Exception(f"Hugging Face API kļūda: {item['error']}")
+    return str(item)
+
+
+def _split_results(data, count):
+    if count == 1:
+        if isinstance(data, list) and len(data) > 0 and isinstance(data[0], dict) and "generated_text" in data[0]:
+            return [data[0]["generated_text"]]
+        return [str(data)]
+    if isinstance(data, list) and len(data) == count:
+        return [_parse_item(item) for item in data]
+    raise HFBatchRejected(f"negaidīta atbilde uz {count} jautājumiem")
+
+
+async def _post(inputs):
+    with stage_latency.time(stage="hf_request"):
+        async with _session.post(HF_API_URL, headers=_headers, json={"inputs": inputs}) as resp:
+            if resp.status != 200:
+                if isinstance(inputs, list) and resp.status in BATCH_REJECTED_STATUSES:
+                    raise HFBatchRejected(f"Hugging Face API kļūda: {resp.status}")
+                raise Exception(f"Hugging Face API kļūda: {resp.status}")
+            return await resp.json()
+
+
+async def _post_batch(prompts):
+    """
+    Один HTTP-запрос на всю пачку. Если API отверг сами входные данные (400/422
+    или ответ не той длины) — шлём по одному, чтобы изолировать плохой промпт.
+    Перегрузка, 5xx и таймаут валят всю пачку сразу: у вопросов есть fallback,
+    а лишние запросы в такой момент эндпоинту только мешают.
+    """
+    try:
+        async with _semaphore:
+            data = await _post(prompts if len(prompts) > 1 else prompts[0])
+        return _split_results(data, len(prompts))
+    except HFBatchRejected as e:
+        logger.warning(f"Pakete noraidīta, sūtām pa vienam: {e}")
+        results = await asyncio.gather(*[_post_batch([p]) for p in prompts], return_exceptions=True)
+        return [r[0] if isinstance(r, list) else r for r in results]
+
+
+async def _limited_post(prompt_text):
+    global _pending
+    if _pending >= HF_MAX_CONCURRENCY * HF_BATCH_SIZE + HF_MAX_QUEUE:
+        raise HFBusyError(f"{_pending} jautājumi rindā")
+    _pending += 1
+    try:
+        return await _batcher.submit(prompt_text)
+    finally:
+        _pending -= 1
+
+
+def _error_answer(e, lang=DEFAULT_LANGUAGE):
+    if isinstance(e, asyncio.TimeoutError):
+        logger.error("Hugging Face API timeout")
+        return get_text("ai_timeout", lang)
+    if isinstance(e, HFBusyError):
+        logger.warning(f"Hugging Face rinda pilna: {e}")
+        return get_text("ai_busy", lang)
+    if isinstance(e, aiohttp.ClientError):
+        logger.error(f"Tīkla kļūda: {e}")
+        return get_text("ai_network_error", lang)
+    logger.error(f"Negaidīta kļūda: {e}")
+    return get_text("ai_unexpected_error", lang)
+
+
+async def _answer_and_cache(key, prompt_text):
+    answer = await _limited_post(prompt_text)
+    answer_cache.set(key, answer)
+    return answer
+
+
+def _forget(key, task):
+    _inflight.pop(key, None)
+    # забираем исключение, даже если ждать его уже некому
+    if not task.cancelled():
+        task.exception()
+
+
+async def ask_about_movie(title, question, fallback=None, lang=DEFAULT_LANGUAGE):
+    """
+    Ответ модели на вопрос о фильме. Одинаковые (после нормализации) вопросы
+    про один фильм отдаются из LRU-кэша, а одновременные — ждут один запрос.
+    Ошибки не кэшируются и превращаются в понятное пользователю сообщение на языке lang.
+    С fallback при ошибке или ответе дольше HF_FALLBACK_AFTER отдаём его.
+    """
+    key = (normalize_text(title), normalize_text(question))
+    cached = answer_cache.get(key)
+    if cached is not None:
+        return cached
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_answer_and_cache(key, make_prompt(title, question)))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _forget(key, t))
+    try:
+        if fallback is None:
+            return await asyncio.shield(task)
+        return await asyncio.wait_for(asyncio.shield(task), HF_FALLBACK_AFTER)
+    except Exception as e:
+        if fallback is not None:
+            logger.info(f"AI atbilde no lokālā dzinēja: {e!r}")
+            fallbacks.inc(kind="ai_fallback")
+            return fallback
+        return _error_answer(e, lang)
+
+
+class HFStreamingModel:
+    """
+    Потоковый ответ inference API ("stream": true, server-sent events).
+    Если эндпоинт не умеет стримить и вернул обычный JSON — отдаём ответ одним куском.
+    """
+
+    async def stream(self, prompt_text):
+        async with _semaphore:
+            async with _session.post(
+                HF_API_URL, headers=_headers, json={"inputs": prompt_text, "stream": True}
+            ) as resp:
+                if resp.status != 200:
+                    raise Exception(f"Hugging Face API kļūda: {resp.status}")
+                if "text/event-stream" not in resp.headers.get("Content-Type", ""):
+                    yield _split_results(await resp.json(), 1)[0]
+                    return
+                async for raw in resp.content:
+                    line = raw.decode("utf-8", "ignore").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    try:
+                        event = json.loads(line[5:])
+                    except ValueError:
+                        continue
+                    token = event.get("token") or {}
+                    if token.get("text") and not token.get("special"):
+                        yield token["text"]
+
+
+class ScriptedModel:
+    """
+    Локальная замена модели для тестов и бенчмарков: отдаёт ответ answer(prompt)
+    по словам с задержкой delay, без сети.
+    """
+
+    def __init__(self, answer=None, delay=0.05):
+        self.answer = answer or (lambda prompt: "Meow. This is a scripted answer.")
+        self.delay = delay
+
+    async def stream(self, prompt_text):
+        words = self.answer(prompt_text).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.delay)
+            yield word if i == 0 else " " + word
+
+
+def set_stream_model(model):
+    """Подменяет потоковую модель (None — вернуть HFStreamingModel)."""
+    global _stream_model
+    _stream_model = model
+
+
+async def stream_about_movie(title, question, fallback=None, lang=DEFAULT_LANGUAGE):
+    """
+    Асинхронный генератор: отдаёт накопленный текст ответа по мере прихода токенов.
+    Готовый ответ из кэша приходит сразу одним куском; в кэш кладётся только
+    поток, дошедший до конца, — оборванный на середине ответ не кэшируем.
+    Если модель упала или промолчала, не сказав ничего, отдаём fallback (если он есть).
+    """
+    global _pending
+    key = (normalize_text(title), normalize_text(question))
+    cached = answer_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    if _pending >= HF_MAX_CONCURRENCY * HF_BATCH_SIZE + HF_MAX_QUEUE:
+        if fallback:
+            fallbacks.inc(kind="ai_fallback")
+        yield fallback or _error_answer(HFBusyError(f"{_pending} jautājumi rindā"), lang)
+        return
+
+    model = _stream_model or HFStreamingModel()
+    text = ""
+    error = None
+    _pending += 1
+    try:
+        async for token in model.stream(make_prompt(title, question)):
+            text += token
+            yield text
+    except Exception as e:
+        error = e
+    finally:
+        _pending -= 1
+
+    if not text.strip():
+        # упал до первого токена или закончил пустым ответом — заглушку "🤖 …" оставлять нельзя
+        error = error or Exception("Hugging Face atbilde ir tukša")
+        if fallback:
+            logger.info(f"AI atbilde no lokālā dzinēja: {error!r}")
+            fallbacks.inc(kind="ai_fallback")
+        yield fallback or _error_answer(error, lang)
+    elif error is not None:
+        logger.warning(f"Straumēšana pārtrūka: {error}")
+    else:
+        answer_cache.set(key, text.strip())
+
+
+def hf_stats():
+    batches = _batcher.stats if _batcher else {}
+    return dict(answer_cache.stats, cached=len(answer_cache), pending=_pending, **batches)
+
+
+def _collect_hf_metrics():
+    events = [({"event": key}, value) for key, value in answer_cache.stats.items()]
+    samples = [
+        ("meowie_ai_cache_events_total", "counter", "AI answer cache hits and misses.", events),
+        ("meowie_ai_pending", "gauge", "AI questions waiting or in flight.", [({}, _pending)]),
+    ]
+    if _batcher is not None:
+        samples.append((
+            "meowie_ai_batch_total", "counter", "AI batches and prompts sent.",
+            [({"kind": key}, value) for key, value in _batcher.stats.items()],
+        ))
+    return samples
+
+
+register_collector(_collect_hf_metrics)
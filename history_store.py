@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import stage_latency
+
+logger = logging.getLogger("history_store")
+
+
+class HistoryStore:
+    """
+    Append-only история рекомендаций в SQLite.
+    Каждая рекомендация — одна новая строка, индекс (user_id, id) даёт
+    быстрый "последние N для пользователя" без чтения всей истории.
+    Методы синхронные — из async-кода их вызываем через asyncio.to_thread.
+    """
+
+    def __init__(self, path="user_history.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS history_user ON history (user_id, id);
+            """
+        )
+        self._conn.commit()
+
+    def append_many(self, rows):
+        now = time.time()
+        values = [(str(user_id), now, json.dumps(item, ensure_ascii=False)) for user_id, item in rows]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO history (user_id, created_at, data) VALUES (?, ?, ?)", values
+            )
+
+    def last(self, user_id, limit=5):
+        """Последние limit записей пользователя, от старых к новым."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (str(user_id), limit),
+            ).fetchall()
+        return [json.loads(data) for (data,) in reversed(rows)]
+
+    def migrate_json(self, json_path):
+        """
+        Одноразовый перенос старого user_history.json. После удачного импорта
+        файл переименовывается в *.migrated, поэтому повторный запуск ничего не делает.
+        """
+        if not os.path.exists(json_path):
+            return 0
+        with open(json_path, "r") as f:
+            data = json.load(f) or {}
+        rows = [(user_id, item) for user_id, items in data.items() for item in items]
+        if rows:
+            self.append_many(rows)
+        os.replace(json_path, json_path + ".migrated")
+        logger.info(f"Vēsture pārnesta no {json_path}: {len(rows)} ieraksti")
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class HistoryWriter:
+    """
+    Write-behind запись истории: хендлер кладёт событие в память и сразу отвечает
+    пользователю, а фоновая задача пишет пачкой — по batch_size событий или раз
+    в flush_interval секунд. Каждая пачка — одна транзакция SQLite (WAL), поэтому
+    после падения в базе либо вся пачка, либо ничего. При штатной остановке
+    stop() дописывает всё, что осталось в очереди.
+    """
+
+    def __init__(self, store, batch_size=100, flush_interval=1.0):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._flushing = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    def add(self, user_id, item):
+        self._buffer.append((str(user_id), item))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending_for(self, user_id):
+        user_id = str(user_id)
+        return [item for uid, item in self._flushing + self._buffer if uid == user_id]
+
+    async def flush(self):
+        if not self._buffer or self._flushing:
+            return 0
+        self._flushing, self._buffer = self._buffer, []
+        try:
+            with stage_latency.time(stage="history_flush"):
+                await asyncio.to_thread(self.store.append_many, self._flushing)
+            return len(self._flushing)
+        except Exception as e:
+            logger.error(f"History flush failed ({len(self._flushing)} ieraksti): {e}")
+            # вернём пачку в начало очереди, попробуем в следующий раз
+            self._buffer[:0] = self._flushing
+            return 0
+        finally:
+            self._flushing = []
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # не отменяем задачу посреди записи — просим её выйти после текущей пачки
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        while self._buffer:
+            if not await self.flush():
+                break
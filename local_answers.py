@@ -0,0 +1,117 @@
+import re
+
+from localization import DEFAULT_LANGUAGE, get_text
+from movie_index import movie_genres
+
+# Частые типы вопросов и фразы, по которым их узнаём (латышский + английский).
+# Локальный ответ идёт раньше модели, поэтому фразы только однозначные: общие
+# слова вроде "when", "good", "about" сами по себе ничего не решают.
+INTENTS = [
+    ("runtime", {"how long", "runtime", "run time", "how many minutes", "duration", "length of",
+                 "cik ilgi", "cik ilga", "cik gara", "cik garš", "ilgums", "cik minūtes", "cik minūšu"}),
+    ("year", {"what year", "which year", "release year", "released", "came out", "come out",
+              "kurā gadā", "kad iznāca", "kad tā iznāca", "iznāca", "iznākšanas gads", "izdošanas gads"}),
+    ("kids", {"for kids", "for children", "for a child", "kid friendly", "kid-friendly", "family friendly",
+              "family-friendly", "age rating", "piemērota bērniem", "der bērniem", "bērniem", "ģimenei",
+              "vecuma ierobežojums"}),
+    ("scary", {"scary", "frightening", "creepy", "biedējoša", "baisa", "bailīga", "būs bail"}),
+    ("rating", {"rating", "score", "imdb", "how good is", "is it any good", "vērtējums", "reitings"}),
+    ("genre", {"genre", "what kind of movie", "what kind of film", "what type of movie", "what type of film",
+               "žanrs", "žanra", "kāda veida filma"}),
+    ("plot", {"what is it about", "what s it about", "what is the movie about", "what is the film about",
+              "plot", "synopsis", "summary", "storyline", "par ko", "sižets", "apraksts"}),
+]
+
+# Вопросы, похожие на частые, но про другое ("когда происходит действие",
+# "в каком году разворачивается") — их всегда отдаём модели
+MODEL_PHRASES = {"take place", "takes place", "set in", "setting", "norisinās", "notiek darbība"}
+
+SCARY_GENRES = {"horror", "thriller"}
+KIDS_OK = {"G", "PG"}
+KIDS_TEEN = {"PG-13"}
+KIDS_NO = {"R", "NC-17"}
+OVERVIEW_LIMIT = 400
+
+def _normalize(text):
+    text = re.sub(r"[^\w\s-]", " ", (text or "").lower())
+    return " " + " ".join(text.split()) + " "
+
+
+def classify_question(question):
+    """
+    Возвращает тип вопроса из INTENTS или None, если явного совпадения нет:
+    ни одной фразы, ничья между типами или вопрос про то, что знает только модель.
+    """
+    text = _normalize(question)
+    if any(f" {phrase} " in text for phrase in MODEL_PHRASES):
+        return None
+    scores = sorted(
+        ((sum(1 for phrase in phrases if f" {phrase} " in text), intent) for intent, phrases in INTENTS),
+        reverse=True,
+    )
+    (best_score, best), (second_score, _) = scores[0], scores[1]
+    if best_score == 0 or best_score == second_score:
+        return None
+    return best
+
+
+def _fields(movie):
+    overview = (movie.get("overview") or "").strip()
+    if len(overview) > OVERVIEW_LIMIT:
+        overview = overview[:OVERVIEW_LIMIT].rsplit(" ", 1)[0] + "…"
+    rating = movie.get("rating") or 0
+    return {
+        "title": movie.get("title") or "?",
+        "year": movie.get("year"),
+        "runtime": movie.get("runtime"),
+        "rating": f"{rating:.1f}" if rating else None,
+        "genres": movie.get("genres") or None,
+        "certification": (movie.get("certification") or "").upper() or None,
+        "overview": overview or None,
+    }
+
+
+def answer_locally(movie, question, lang=DEFAULT_LANGUAGE):
+    """
+    Ответ на частый вопрос прямо из полей фильма (overview, genres, year,
+    rating, runtime, certification) — без сети. None, если вопрос не распознан
+    или нужного поля нет: тогда спрашиваем модель. Шаблоны — answer_* в localization.
+    """
+    if not movie:
+        return None
+    intent = classify_question(question)
+    if intent is None:
+        return None
+    fields = _fields(movie)
+
+    def render(key):
+        return get_text(f"answer_{key}", lang).format(**fields)
+
+    if intent == "scary":
+        if not fields["genres"]:
+            return None
+        key = "scary_yes" if movie_genres(movie) & SCARY_GENRES else "scary_no"
+        return render(key)
+
+    if intent == "kids":
+        certification = fields["certification"]
+        if certification in KIDS_OK:
+            return render("kids_yes")
+        if certification in KIDS_TEEN:
+            return render("kids_teen")
+        if certification in KIDS_NO:
+            return render("kids_no")
+        return None
+
+    needed = {"runtime": "runtime", "year": "year", "rating": "rating", "genre": "genres", "plot": "overview"}[intent]
+    if not fields[needed]:
+        return None
+    return render(intent)
+
+
+def fallback_answer(movie, lang=DEFAULT_LANGUAGE):
+    """Запасной ответ, когда модель молчит или падает: краткий пересказ из overview."""
+    fields = _fields(movie or {})
+    if not fields["overview"]:
+        return None
+    return get_text("answer_fallback", lang).format(**fields)
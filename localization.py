@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+from pathlib import Path
+from types import MappingProxyType
+
+logger = logging.getLogger("localization")
+
+DEFAULT_LANGUAGE = "Latviešu"
+# Дополнительные языки: *.json вида {"language": "...", "texts": {ключ: строка}}
+LOCALES_DIR = os.getenv("LOCALES_DIR", "locales")
+
+STRINGS = {
+    "Latviešu": {
+        "start": "Čau, esmu Meowie!🎬\nEs palīdzēšu atrast filmu vakaram.\nNorādi, vai Tu skaties vienatnē vai divatā.\nIzvēlies žanru un laiku, kad plāno skatīties 🐾\n\nVai skatīsies viens vai kopā?",
+        "genre_prompt": "Kādu žanru vēlies? Izvēlies:",
+        "time_prompt": "Cikos skatīsieties filmu?",
+        "rating_prompt": "Izvēlies minimālo filmas vērtējumu:",
+        "invalid_rating": "Lūdzu, ievadi derīgu vērtējumu no 0 līdz 10.",
+        "not_found": "Neizdevās atrast filmu. Pamēģini vēlāk.",
+        "cancel": "Filmas meklēšana atcelta.",
+        "choose_language": "Izvēlies valodu / Choose a language:",
+        "repeat_prompt": "Izvēlies, ko darīt tālāk:",
+        "repeat_option": "🔄 Vēl filmu",
+        "restart_option": "🔁 Sākt no jauna",
+        "cancel_option": "/cancel",
+        "ask_ai_option": "🤖 Ask AI",
+        "people_solo": "Viens",
+        "people_together": "Kopā",
+        "choose_repeat_invalid": "Lūdzu, izvēlies no piedāvātajām opcijām.",
+        "history_empty": "Vēsture ir tukša.",
+        "ask_ai_prompt": "Lūdzu, uzraksti savu jautājumu par filmu. Es gaidīšu tavu ziņu.",
+        "use_buttons": "Lūdzu, izmanto izvēlnes pogas.",
+        "unknown_choice": "Nezināma izvēle. Lūdzu, mēģini vēlreiz.",
+        "slow_down": "🐾 Lēnāk, lūdzu — nākamo filmu varēsi saņemt pēc brīža.",
+        "ai_timeout": "⏳ Servera atbilde aizkavējās. Pamēģini vēlreiz vēlāk.",
+        "ai_network_error": "⚠️ Tīkla kļūda. Lūdzu, mēģini vēlreiz.",
+        "ai_unexpected_error": "⚠️ Negaidīta kļūda. Lūdzu, mēģini vēlreiz.",
+        "ai_busy": "⏳ Šobrīd ir pārāk daudz jautājumu. Pamēģini pēc brīža.",
+        "answer_runtime": "⏱️ „{title}” ilgst apmēram {runtime} minūtes.",
+        "answer_year": "📅 „{title}” iznāca {year}. gadā.",
+        "answer_rating": "⭐ Trakt vērtējums: {rating}/10.",
+        "answer_genre": "🎭 Žanrs: {genres}.",
+        "answer_plot": "📖 {overview}",
+        "answer_scary_yes": "👻 Jā, tā ir diezgan baisa — žanrs: {genres}.",
+        "answer_scary_no": "🙂 Nav īpaši baisa — žanrs: {genres}.",
+        "answer_kids_yes": "👨‍👩‍👧 Der arī bērniem (vecuma ierobežojums: {certification}).",
+        "answer_kids_teen": "🧒 Drīzāk no 13 gadiem (vecuma ierobežojums: {certification}).",
+        "answer_kids_no": "🔞 Bērniem nav ieteicama (vecuma ierobežojums: {certification}).",
+        "answer_fallback": "🤖 Ātrā atbilde no apraksta: {overview}",
+    },
+    "English": {
+        "start": "Hi, I'm Meowie!🎬\nI'll help you find a movie for tonight.\nTell me if you're watching alone or together.\nChoose a genre and time 🐾\n\nAre you watching alone or with someone?",
+        "genre_prompt": "What genre do you want? Choose:",
+        "time_prompt": "When will you watch the movie?",
+        "rating_prompt": "Choose minimum movie rating:",
+        "invalid_rating": "Please enter a valid rating from 0 to 10.",
+        "not_found": "Couldn't find a movie. Try again later.",
+        "cancel": "Movie search cancelled.",
+        "choose_language": "Izvēlies valodu / Choose a language:",
+        "repeat_prompt": "Choose what to do next:",
+        "repeat_option": "🔄 Another movie",
+        "restart_option": "🔁 Restart",
+        "cancel_option": "/cancel",
+        "ask_ai_option": "🤖 Ask AI",
+        "people_solo": "Alone",
+        "people_together": "Together",
+        "choose_repeat_invalid": "Please choose from the offered options.",
+        "history_empty": "History is empty.",
+        "ask_ai_prompt": "Please write your question about the movie. I'll wait for your message.",
+        "use_buttons": "Please use the menu buttons.",
+        "unknown_choice": "Unknown choice. Please try again.",
+        "slow_down": "🐾 Easy there — you can get the next movie in a moment.",
+        "ai_timeout": "⏳ The server took too long to answer. Please try again later.",
+        "ai_network_error": "⚠️ Network error. Please try again.",
+        "ai_unexpected_error": "⚠️ Unexpected error. Please try again.",
+        "ai_busy": "⏳ Too many questions right now. Try again in a moment.",
+        "answer_runtime": "⏱️ “{title}” runs about {runtime} minutes.",
+        "answer_year": "📅 “{title}” came out in {year}.",
+        "answer_rating": "⭐ Trakt rating: {rating}/10.",
+        "answer_genre": "🎭 Genre: {genres}.",
+        "answer_plot": "📖 {overview}",
+        "answer_scary_yes": "👻 Yes, it's pretty scary — genre: {genres}.",
+        "answer_scary_no": "🙂 Not really scary — genre: {genres}.",
+        "answer_kids_yes": "👨‍👩‍👧 Fine for kids too (rated {certification}).",
+        "answer_kids_teen": "🧒 Better for 13+ (rated {certification}).",
+        "answer_kids_no": "🔞 Not for kids (rated {certification}).",
+        "answer_fallback": "🤖 Quick answer from the synopsis: {overview}",
+    },
+}
+
+# Кнопки, которые узнаём по тексту на любом языке
+OPTION_KEYS = ("repeat_option", "restart_option", "cancel_option", "people_solo", "people_together")
+
+LANGUAGES = []
+_tables = {}
+_options = {}
+_listeners = []
+
+
+def _normalize(text):
+    return " ".join((text or "").split()).casefold()
+
+
+def _compile():
+    """Собирает неизменяемые таблицы по языкам и обратный индекс текст кнопки -> ключ."""
+    default = STRINGS[DEFAULT_LANGUAGE]
+    tables = {}
+    options = {}
+    for lang, strings in STRINGS.items():
+        tables[lang] = MappingProxyType({key: strings.get(key, text) for key, text in default.items()})
+        for key in OPTION_KEYS:
+            options.setdefault(_normalize(tables[lang][key]), key)
+    _tables.clear()
+    _tables.update(tables)
+    _options.clear()
+    _options.update(options)
+    LANGUAGES[:] = list(STRINGS)
+    for callback in _listeners:
+        callback()
+
+
+def on_languages_changed(callback):
+    """callback() вызывается после каждого register_language — например, чтобы сбросить готовые клавиатуры."""
+    _listeners.append(callback)
+
+
+def register_language(lang, strings):
+    """Подключает ещё один язык; недостающие строки берутся из языка по умолчанию."""
+    unknown = set(strings) - set(STRINGS[DEFAULT_LANGUAGE])
+    if unknown:
+        logger.warning(f"Nezināmas atslēgas valodā {lang}: {', '.join(sorted(unknown))}")
+    STRINGS[lang] = dict(strings)
+    _compile()
+
+
+def load_locales(path=LOCALES_DIR):
+    directory = Path(path)
+    if not directory.is_dir():
+        return
+    for file in sorted(directory.glob("*.json")):
+        try:
+            data = json.loads(file.read_text(encoding="utf-8"))
+            register_language(data["language"], data["texts"])
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Neizdevās ielādēt {file}: {e}")
+
+
+def get_text(key, lang):
+    return _tables.get(lang, _tables[DEFAULT_LANGUAGE])[key]
+
+
+def match_option(text):
+    """Ключ кнопки (repeat_option, restart_option, cancel_option, people_*) по её тексту или None."""
+    return _options.get(_normalize(text))
+
+
+_compile()
+load_locales()
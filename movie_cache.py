@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("movie_cache")
+
+
+class GenreCache:
+    """
+    Кэш нормализованных списков фильмов по жанру.
+    - пока запись моложе ttl, отдаём её как есть;
+    - в окне ttl..ttl+stale_ttl отдаём старую запись и обновляем её в фоне;
+    - одновременные промахи по одному ключу ждут один и тот же запрос к API;
+    - ещё более старую запись пробуем обновить, но если API падает или отвечает
+      дольше slow_timeout, отдаём то, что есть.
+    loader(key) должен бросать исключение при ошибке — ошибки не кэшируются.
+    store_loader(key) (необязательно) читает (value, unix_time) с диска при
+    первом обращении к ключу, чтобы после рестарта не ходить в API.
+    """
+
+    def __init__(self, loader, ttl=600, stale_ttl=3600, store_loader=None, slow_timeout=3.0):
+        self._loader = loader
+        self._store_loader = store_loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.slow_timeout = slow_timeout
+        self._entries = {}   # key -> (value, fetched_at)
+        self._inflight = {}  # key -> asyncio.Task
+        self._store_tasks = {}  # key -> asyncio.Task, чтобы диск читался один раз
+        self._prefetching = {}  # key -> asyncio.Task прогрева
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "store_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "refreshes": 0,
+            "fallbacks": 0,
+            "errors": 0,
+            "prefetches": 0,
+        }
+
+    def peek(self, key):
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def put(self, key, value, fetched_at=None):
+        self._entries[key] = (value, time.monotonic() if fetched_at is None else fetched_at)
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None and self._store_loader is not None:
+            value = await self._from_store(key)
+            if value:
+                return value
+            entry = self._entries.get(key)
+
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                self.refresh(key)
+                return value
+            try:
+                fresh = await asyncio.wait_for(asyncio.shield(self.refresh(key)), self.slow_timeout)
+                self.stats["misses"] += 1
+                return fresh or value
+            except Exception as e:
+                self.stats["fallbacks"] += 1
+                logger.info(f"Atdodam vecu kešu ({key}): {e!r}")
+                return value
+
+        self.stats["misses"] += 1
+        return await self._load(key)
+
+    async def _from_store(self, key):
+        task = self._store_tasks.get(key)
+        if task is None:
+            task = self._store_tasks[key] = asyncio.ensure_future(self._read_store(key))
+        value = await asyncio.shield(task)
+        if value:
+            self.stats["store_hits"] += 1
+        return value
+
+    async def _read_store(self, key):
+        try:
+            stored = await self._store_loader(key)
+        except Exception as e:
+            logger.error(f"Neizdevās nolasīt katalogu no diska ({key}): {e}")
+            return None
+        if not stored:
+            return None
+        value, stored_at = stored
+        if key not in self._entries:
+            age = max(0.0, time.time() - stored_at)
+            self.put(key, value, time.monotonic() - age)
+            if age >= self.ttl:
+                self.refresh(key)
+        return self._entries[key][0]
+
+    def refresh(self, key):
+        """Запускает фоновое обновление, если оно ещё не идёт."""
+        if key in self._inflight:
+            return self._inflight[key]
+        self.stats["refreshes"] += 1
+        return self._start_load(key)
+
+    def prefetch(self, key):
+        """
+        Прогревает ключ в фоне, ничего не дожидаясь. Свежую запись не трогает;
+        повторные прогревы и обычные get по тому же ключу сливаются в одно
+        чтение с диска и один запрос к API.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return None
+        task = self._prefetching.get(key)
+        if task is None:
+            self.stats["prefetches"] += 1
+            task = self._prefetching[key] = asyncio.ensure_future(self._prefetch(key))
+            task.add_done_callback(lambda t: self._prefetching.pop(key, None))
+        return task
+
+    async def _prefetch(self, key):
+        try:
+            if key not in self._entries and self._store_loader is not None:
+                await self._from_store(key)
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                await self.refresh(key)
+        except Exception as e:
+            logger.info(f"Priekšielāde neizdevās ({key}): {e!r}")
+
+    async def _load(self, key):
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start_load(key)
+        else:
+            self.stats["coalesced"] += 1
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def _start_load(self, key):
+        task = asyncio.ensure_future(self._fetch(key))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        return task
+
+    async def _fetch(self, key):
+        value = await self._loader(key)
+        if value:
+            self.put(key, value)
+        return value
+
+    def _done(self, key, task):
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            self.stats["errors"] += 1
+            logger.warning(f"Kešu neizdevās atjaunot ({key}): {exc}")
+
+    def snapshot(self):
+        served = sum(self.stats[k] for k in ("hits", "stale_hits", "store_hits", "fallbacks"))
+        total = served + self.stats["misses"]
+        return dict(self.stats, entries=len(self._entries), hit_ratio=round(served / total, 3) if total else 0.0)
+
+
+class LRUCache:
+    """Небольшой LRU-кэш с TTL: при переполнении выкидывается самая давно нужная запись."""
+
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self.stats = {"hits": 0, "misses": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.stats["misses"] += 1
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            self.stats["misses"] += 1
+            return None
+        self._data.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
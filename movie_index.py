@@ -0,0 +1,222 @@
+import math
+import random
+from bisect import bisect_right
+
+# Пороги из RATING_OPTIONS в bot.py ("9+" превращается в 8.5) плюс 0 — "без фильтра"
+RATING_THRESHOLDS = (0, 5, 6, 7, 8, 8.5)
+
+# Ключ кнопки "Viens/Kopā" на любом языке (localization.match_option) -> аудитория для весов
+PEOPLE_AUDIENCE = {
+    "people_solo": "solo",
+    "people_together": "together",
+}
+AUDIENCES = ("solo", "together")
+
+# TIME_EMOJIS из bot.py -> время суток
+TIME_SLOTS = {
+    "🌅": "morning",
+    "🌇": "evening",
+    "🌃": "night",
+}
+SLOTS = ("morning", "evening", "night")
+
+# Жанры, которые лучше смотреть в компании или одному (слаги Trakt)
+TOGETHER_GENRES = {"comedy", "romance", "action", "adventure", "family", "animation", "fantasy", "musical"}
+SOLO_GENRES = {"drama", "horror", "thriller", "mystery", "documentary", "science-fiction", "crime", "war"}
+MORNING_GENRES = {"comedy", "family", "animation", "adventure", "documentary", "romance", "musical"}
+EVENING_GENRES = {"drama", "romance", "action", "science-fiction", "fantasy", "crime"}
+NIGHT_GENRES = {"horror", "thriller", "mystery", "science-fiction", "crime"}
+HEAVY_GENRES = {"horror", "thriller", "war"}
+FAMILY_CERTIFICATIONS = {"G", "PG", "PG-13"}
+ADULT_CERTIFICATIONS = {"R", "NC-17"}
+
+# Сколько последних фильмов пользователя помним, чтобы не предлагать их снова
+SEEN_LIMIT = 200
+# Сколько уже виденных фильмов максимум пропускаем за один выбор
+MAX_SKIPS = 32
+
+
+def movie_rating(movie):
+    return movie.get("rating") or 0
+
+
+def movie_genres(movie):
+    genres = movie.get("genres") or ""
+    if isinstance(genres, str):
+        genres = genres.split(", ")
+    return {g.strip().lower().replace(" ", "-") for g in genres if g}
+
+
+def group_scores(movie):
+    """
+    Насколько фильм подходит для просмотра одному и вдвоём/в компании.
+    Считается один раз при обновлении каталога по runtime, certification и жанрам.
+    Возвращает dict {audience: вес > 0}.
+    """
+    genres = movie_genres(movie)
+    runtime = movie.get("runtime") or 0
+    certification = (movie.get("certification") or "").upper()
+
+    solo = 1.0 + 0.5 * len(genres & SOLO_GENRES)
+    together = 1.0 + 0.5 * len(genres & TOGETHER_GENRES)
+
+    if certification in FAMILY_CERTIFICATIONS:
+        together += 0.5
+    elif certification in ADULT_CERTIFICATIONS:
+        solo += 0.3
+
+    # Длинный фильм сложнее досмотреть вместе, короткий — легко
+    if runtime > 150:
+        together *= 0.6
+    elif 0 < runtime <= 120:
+        together *= 1.2
+
+    return {"solo": solo, "together": together}
+
+
+def time_scores(movie):
+    """
+    Насколько фильм подходит утру, вечеру и поздней ночи — по длительности и жанрам.
+    Считается один раз при обновлении каталога. Возвращает dict {slot: вес > 0}.
+    """
+    genres = movie_genres(movie)
+    runtime = movie.get("runtime") or 0
+
+    morning = 1.0 + 0.5 * len(genres & MORNING_GENRES)
+    evening = 1.0 + 0.5 * len(genres & EVENING_GENRES)
+    night = 1.0 + 0.5 * len(genres & NIGHT_GENRES)
+
+    if genres & HEAVY_GENRES:
+        morning *= 0.5
+    if genres & {"family", "animation"}:
+        night *= 0.6
+
+    # Утром и ночью времени меньше, чем вечером
+    if runtime > 140:
+        morning *= 0.5
+        night *= 0.7
+    elif 0 < runtime <= 100:
+        morning *= 1.3
+        night *= 1.2
+
+    return {"morning": morning, "evening": evening, "night": night}
+
+
+class GenrePool:
+    """
+    Индекс фильмов одного жанра. Строится один раз при обновлении каталога:
+    фильмы отсортированы по рейтингу по убыванию, поэтому "рейтинг >= X" —
+    это просто префикс списка, а его длина для порогов заранее посчитана.
+    Веса аудитории/времени суток считаются при построении, а наибольший вес
+    префикса (для rejection sampling в pick_without_repeat) — лениво, при первом
+    запросе с этой комбинацией и порогом. Большие пулы стоит строить через
+    asyncio.to_thread (см. trakt_recommendation.make_pool).
+    """
+
+    def __init__(self, movies, thresholds=RATING_THRESHOLDS):
+        self.movies = sorted(movies, key=movie_rating, reverse=True)
+        # bisect работает по возрастанию, поэтому храним рейтинги со знаком минус
+        self._neg_ratings = [-movie_rating(m) for m in self.movies]
+        self.thresholds = tuple(sorted(set(thresholds) | {0}, reverse=True))
+        self._counts = {t: bisect_right(self._neg_ratings, -t) for t in self.thresholds}
+
+        # Веса "одному/вместе" и времени суток — один раз на обновление
+        self._group = [group_scores(m) for m in self.movies]
+        self._times = [time_scores(m) for m in self.movies]
+        self._max_weights = {}  # (audience, slot, threshold) -> наибольший вес в префиксе
+
+    def __len__(self):
+        return len(self.movies)
+
+    def count_at_least(self, min_rating):
+        count = self._counts.get(min_rating)
+        if count is None:
+            count = bisect_right(self._neg_ratings, -min_rating)
+        return count
+
+    def nearest_threshold(self, min_rating):
+        """Самый высокий порог не выше min_rating, у которого есть фильмы."""
+        if self.count_at_least(min_rating):
+            return min_rating
+        for threshold in self.thresholds:
+            if threshold < min_rating and self._counts[threshold]:
+                return threshold
+        return None
+
+    def weight(self, index, audience=None, slot=None):
+        g, t = self._group[index], self._times[index]
+        return (g[audience] if audience in g else 1.0) * (t[slot] if slot in t else 1.0)
+
+    def max_weight(self, audience, slot, threshold):
+        key = (audience, slot, threshold)
+        if key not in self._max_weights:
+            count = self.count_at_least(threshold)
+            self._max_weights[key] = max((self.weight(i, audience, slot) for i in range(count)), default=0.0)
+        return self._max_weights[key]
+
+
+def movie_key(movie):
+    """Ключ фильма для "уже видел": trakt_url есть и в каталоге, и в истории (url)."""
+    return movie.get("trakt_url") or movie.get("url")
+
+
+def remember_seen(seen, key, limit=SEEN_LIMIT):
+    """seen — dict как упорядоченное множество: самые старые ключи вытесняются первыми."""
+    if not key:
+        return
+    seen.pop(key, None)
+    seen[key] = None
+    if len(seen) > limit:
+        del seen[next(iter(seen))]
+
+
+def _new_cycle(n):
+    # Перестановка i -> (a*i + b) mod n при gcd(a, n) == 1 обходит все индексы
+    # ровно по разу, а хранить нужно только три числа и курсор.
+    a = 1
+    if n > 2:
+        a = random.randrange(1, n)
+        while math.gcd(a, n) != 1:
+            a = random.randrange(1, n)
+    return [n, a, random.randrange(n), 0]
+
+
+def pick_without_repeat(pool, min_rating, cycles, seen, audience=None, slot=None):
+    """
+    Выбор без повторов из префикса пула для порога рейтинга.
+    cycles — dict {порог: [n, a, b, cursor]} из user_data (по одному на жанр),
+    seen — dict недавно показанных ключей. Новая перестановка создаётся только
+    когда текущая исчерпана или размер пула изменился.
+    С audience/slot курсор идёт по той же перестановке, но кандидат принимается
+    с вероятностью вес / наибольший вес (rejection sampling): за один проход
+    перестановки фильм не повторяется, а подходящие чаще оказываются выбраны.
+    """
+    threshold = pool.nearest_threshold(min_rating)
+    if threshold is None:
+        return None, None
+    n = pool.count_at_least(threshold)
+
+    cycle = cycles.get(threshold)
+    if cycle is None or cycle[0] != n:
+        cycle = cycles[threshold] = _new_cycle(n)
+    top = pool.max_weight(audience, slot, threshold) if audience or slot else 0.0
+
+    fallback = rejected = None
+    for _ in range(min(n, MAX_SKIPS)):
+        if cycle[3] >= n:
+            cycle[:] = _new_cycle(n)
+        _, a, b, cursor = cycle
+        cycle[3] += 1
+        index = (a * cursor + b) % n
+        movie = pool.movies[index]
+        if movie_key(movie) in seen:
+            if fallback is None:
+                fallback = movie
+            continue
+        if top and random.random() * top > pool.weight(index, audience, slot):
+            if rejected is None:
+                rejected = movie
+            continue
+        return movie, threshold
+    # все попытки ушли на отказы: лучше не виденный, чем уже показанный
+    return rejected or fallback, threshold
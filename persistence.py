@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger("persistence")
+
+
+class SqlitePersistence(BasePersistence):
+    """
+    Хранит user_data и состояния ConversationHandler в SQLite, чтобы деплой не
+    сбрасывал пользователей посреди диалога.
+    - PTB сам вызывает update_* раз в update_interval секунд и только для
+      пользователей, которых трогали апдейты; строки, которые не изменились,
+      мы ещё и не переписываем.
+    - user_data при старте не читается целиком: get_user_data отдаёт пустой
+      dict, а данные пользователя подгружаются в refresh_user_data при его
+      первом апдейте.
+    - чтобы сравнивать без хранения самих данных, помним только blake2b
+      последней записи, а пользователей, молчащих дольше idle_ttl, забываем
+      совсем (при следующем апдейте их данные снова прочитаются из базы).
+    """
+
+    def __init__(self, path="state.db", update_interval=30, idle_ttl=3600):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self.idle_ttl = max(idle_ttl, 2 * update_interval)  # не забывать того, кто ещё не записан
+        self._loaded_users = set()
+        self._written = {}  # user_id -> blake2b последней записи
+        self._touched = OrderedDict()  # user_id -> time.monotonic() последнего обращения
+
+    @staticmethod
+    def _digest(blob):
+        return hashlib.blake2b(blob, digest_size=16).digest()
+
+    def _touch(self, user_id):
+        """Отмечает обращение и выкидывает давно молчащих: OrderedDict держит их в голове."""
+        now = time.monotonic()
+        self._touched.pop(user_id, None)
+        self._touched[user_id] = now
+        while self._touched:
+            oldest, touched_at = next(iter(self._touched.items()))
+            if now - touched_at < self.idle_ttl:
+                break
+            del self._touched[oldest]
+            self._loaded_users.discard(oldest)
+            self._written.pop(oldest, None)
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS user_data (
+                    user_id INTEGER PRIMARY KEY,
+                    data BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS conversations (
+                    name TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    state BLOB NOT NULL,
+                    PRIMARY KEY (name, key)
+                );
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _execute(self, sql, params=(), fetch=False):
+        with self._lock:
+            conn = self._connect()
+            if fetch:
+                return conn.execute(sql, params).fetchall()
+            with conn:
+                conn.execute(sql, params)
+
+    async def _run(self, sql, params=(), fetch=False):
+        return await asyncio.to_thread(self._execute, sql, params, fetch)
+
+    # --- user_data ---
+
+    async def get_user_data(self):
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        self._touch(user_id)
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        rows = await self._run("SELECT data FROM user_data WHERE user_id = ?", (user_id,), fetch=True)
+        if not rows:
+            return
+        self._written[user_id] = self._digest(rows[0][0])
+        try:
+            stored = pickle.loads(rows[0][0])
+        except Exception as e:
+            logger.error(f"Bojāti lietotāja dati ({user_id}): {e}")
+            return
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id, data):
+        self._touch(user_id)
+        self._loaded_users.add(user_id)
+        blob = pickle.dumps(dict(data), protocol=pickle.HIGHEST_PROTOCOL)
+        digest = self._digest(blob)
+        if self._written.get(user_id) == digest:
+            return
+        await self._run(
+            "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)", (user_id, blob)
+        )
+        self._written[user_id] = digest
+
+    async def drop_user_data(self, user_id):
+        self._written.pop(user_id, None)
+        self._touched.pop(user_id, None)
+        self._loaded_users.discard(user_id)
+        await self._run("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    # --- conversations ---
+
+    async def get_conversations(self, name):
+        rows = await self._run(
+            "SELECT key, state FROM conversations WHERE name = ?", (name,), fetch=True
+        )
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        key = json.dumps(list(key))
+        if new_state is None:
+            await self._run("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key))
+            return
+        await self._run(
+            "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+            (name, key, pickle.dumps(deepcopy(new_state))),
+        )
+
+    # --- то, что мы не храним ---
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import math
+import os
+import weakref
+
+try:
+    import numpy as np
+except ImportError:  # режим необязательный: без numpy работает обычный выбор
+    np = None
+
+from movie_index import movie_genres, movie_rating, movie_key, group_scores, time_scores, AUDIENCES, SLOTS
+
+logger = logging.getLogger("personalization")
+
+PERSONALIZATION = os.getenv("PERSONALIZATION", "0") == "1"
+# Какая доля старого вкуса остаётся после каждого нового фильма в истории
+TASTE_DECAY = float(os.getenv("TASTE_DECAY", "0.85"))
+# Из скольких лучших по скору кандидатов выбираем и насколько "резко"
+PERSONALIZATION_TOP_K = int(os.getenv("PERSONALIZATION_TOP_K", "20"))
+PERSONALIZATION_TEMPERATURE = float(os.getenv("PERSONALIZATION_TEMPERATURE", "0.2"))
+
+# Признаки фильма: жанры Trakt, десятилетие, длительность, рейтинг
+GENRE_VOCAB = (
+    "action", "adventure", "animation", "anime", "comedy", "crime", "documentary", "drama",
+    "family", "fantasy", "history", "holiday", "horror", "music", "musical", "mystery",
+    "romance", "science-fiction", "short", "sporting-event", "superhero", "suspense",
+    "thriller", "war", "western",
+)
+GENRE_INDEX = {genre: i for i, genre in enumerate(GENRE_VOCAB)}
+DECADES = (1970, 1980, 1990, 2000, 2010, 2020)  # до 1970, 70-е, ..., 2020-е
+RUNTIMES = (95, 140)  # короткий, средний, длинный
+YEAR_OFFSET = len(GENRE_VOCAB)
+RUNTIME_OFFSET = YEAR_OFFSET + len(DECADES) + 1
+RATING_OFFSET = RUNTIME_OFFSET + len(RUNTIMES) + 1
+DIMENSIONS = RATING_OFFSET + 1
+
+if PERSONALIZATION and np is None:
+    logger.warning("PERSONALIZATION=1, bet numpy nav instalēts — izmantojam parasto izvēli")
+
+_pools = weakref.WeakKeyDictionary()  # GenrePool -> PoolFeatures
+_random = np.random.default_rng() if np is not None else None
+
+
+def enabled():
+    return PERSONALIZATION and np is not None
+
+
+def _bucket(value, bounds):
+    for i, bound in enumerate(bounds):
+        if value < bound:
+            return i
+    return len(bounds)
+
+
+def feature_indices(movie):
+    """Номера ненулевых признаков фильма (кроме рейтинга) — общий код для каталога и истории."""
+    indices = [GENRE_INDEX[g] for g in movie_genres(movie) if g in GENRE_INDEX]
+    year = movie.get("year")
+    if isinstance(year, int):
+        indices.append(YEAR_OFFSET + _bucket(year, DECADES))
+    runtime = movie.get("runtime")
+    if runtime:
+        indices.append(RUNTIME_OFFSET + _bucket(runtime, RUNTIMES))
+    return indices
+
+
+def _rating_feature(movie):
+    rating = movie_rating(movie)
+    return max(-1.0, min(1.0, (rating - 5) / 5)) if rating else 0.0
+
+
+class PoolFeatures:
+    """
+    Признаки всего пула, посчитанные один раз: матрица (фильмы × признаки),
+    индекс ключ фильма -> строка и логарифмы весов аудитории и времени суток,
+    чтобы на выборе всё сводилось к одному умножению матрицы на вектор.
+    """
+
+    def __init__(self, pool):
+        movies = pool.movies
+        self.matrix = np.zeros((len(movies), DIMENSIONS), dtype=np.float32)
+        self.index = {}
+        rows, cols = [], []
+        for row, movie in enumerate(movies):
+            indices = feature_indices(movie)
+            rows.extend([row] * len(indices))
+            cols.extend(indices)
+            self.index.setdefault(movie_key(movie), row)
+        self.matrix[rows, cols] = 1.0
+        self.matrix[:, RATING_OFFSET] = [_rating_feature(movie) for movie in movies]
+        group = [group_scores(m) for m in movies]
+        times = [time_scores(m) for m in movies]
+        self.audience = {a: np.log(np.array([g[a] for g in group], dtype=np.float32)) for a in AUDIENCES}
+        self.slot = {s: np.log(np.array([t[s] for t in times], dtype=np.float32)) for s in SLOTS}
+
+
+def pool_features(pool):
+    features = _pools.get(pool)
+    if features is None:
+        features = _pools[pool] = PoolFeatures(pool)
+    return features
+
+
+async def prepare(pool):
+    """Считает признаки пула в потоке, чтобы первый выбор после обновления каталога не блокировал loop."""
+    if pool not in _pools:
+        _pools[pool] = await asyncio.to_thread(PoolFeatures, pool)
+
+
+def update_taste(taste, movie, decay=TASTE_DECAY):
+    """
+    Вкус — экспоненциальное среднее признаков фильмов из истории (list из DIMENSIONS
+    чисел, чтобы user_data можно было прочитать и без numpy). Меняем на месте.
+    """
+    for i in range(DIMENSIONS):
+        taste[i] *= decay
+    weight = 1.0 - decay
+    for i in feature_indices(movie):
+        taste[i] += weight
+    taste[RATING_OFFSET] += weight * _rating_feature(movie)
+    return taste
+
+
+def taste_from_history(items, decay=TASTE_DECAY):
+    """
+    Вкус по старой истории; items — от старых записей к новым (как отдаёт
+    HistoryStore.last), так что самая свежая запись весит больше всех.
+    В записях истории есть только жанр и год.
+    """
+    taste = [0.0] * DIMENSIONS
+    for item in items:
+        update_taste(taste, {"genres": item.get("genre"), "year": item.get("year")}, decay)
+    return taste
+
+
+def pick_personalized(pool, min_rating, taste, seen, audience=None, slot=None):
+    """
+    Как pick_without_repeat, но по вкусу: скор всего префикса порога — одно
+    произведение матрицы признаков на вектор вкуса (плюс веса аудитории/времени),
+    уже виденные отсекаются, а фильм выбирается из TOP_K лучших с softmax-весами.
+    """
+    threshold = pool.nearest_threshold(min_rating)
+    if threshold is None:
+        return None, None
+    n = pool.count_at_least(threshold)
+    features = pool_features(pool)
+
+    scores = features.matrix[:n] @ np.asarray(taste, dtype=np.float32)
+    if audience in features.audience:
+        scores += features.audience[audience][:n]
+    if slot in features.slot:
+        scores += features.slot[slot][:n]
+    for key in seen:
+        row = features.index.get(key)
+        if row is not None and row < n:
+            scores[row] = -np.inf
+
+    k = min(PERSONALIZATION_TOP_K, n)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top_scores = scores[top]
+    allowed = np.isfinite(top_scores)
+    if not allowed.any():
+        # все кандидаты уже видены — отдаём лучшего, лишь бы не остаться без фильма
+        return pool.movies[int(top[0])], threshold
+    top, top_scores = top[allowed], top_scores[allowed]
+    weights = np.exp((top_scores - top_scores.max()) / max(PERSONALIZATION_TEMPERATURE, 1e-3))
+    choice = _random.choice(len(top), p=weights / weights.sum())
+    return pool.movies[int(top[choice])], threshold
+
+
+def has_taste(taste):
+    return bool(taste) and any(not math.isclose(value, 0.0) for value in taste)
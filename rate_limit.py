@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+
+ALLOWED = "allowed"
+LIMITED = "limited"
+DEBOUNCED = "debounced"
+
+
+class UserRateLimiter:
+    """
+    Token bucket на пользователя: rate токенов в секунду, не больше burst подряд.
+    Одинаковое действие, повторённое быстрее debounce секунд, просто отбрасывается
+    (двойной тап). На пользователя хранится одна короткая запись; записи тех,
+    кто молчит дольше idle_ttl, выкидываются по ходу дела — OrderedDict держит
+    их в порядке последнего обращения, так что проверяем только голову.
+    """
+
+    def __init__(self, rate=0.5, burst=5, debounce=0.7, idle_ttl=600.0, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.debounce = debounce
+        self.idle_ttl = idle_ttl
+        self._clock = clock
+        self._buckets = OrderedDict()  # user_id -> [tokens, updated_at, last_action, last_at, warned]
+        self.stats = {ALLOWED: 0, LIMITED: 0, DEBOUNCED: 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _evict(self, now):
+        while self._buckets:
+            user_id, bucket = next(iter(self._buckets.items()))
+            if now - bucket[1] < self.idle_ttl:
+                break
+            del self._buckets[user_id]
+            self.stats["evicted"] += 1
+
+    def check(self, user_id, action=None):
+        """ALLOWED (токен списан), DEBOUNCED (повтор того же действия) или LIMITED."""
+        now = self._clock()
+        self._evict(now)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [float(self.burst), now, None, float("-inf"), False]
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if action is not None and action == bucket[2] and now - bucket[3] < self.debounce:
+            result = DEBOUNCED
+        elif bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2], bucket[3], bucket[4] = action, now, False
+            result = ALLOWED
+        else:
+            result = LIMITED
+        self.stats[result] += 1
+        return result
+
+    def should_warn(self, user_id):
+        """True только для первого отказа подряд — дальше молчим, чтобы не спамить в ответ."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None or bucket[4]:
+            return False
+        bucket[4] = True
+        return True
@@ -0,0 +1,111 @@
+import asyncio
+
+from aiohttp import web
+
+import hf_client
+from hf_client import PromptBatcher
+
+
+def test_prompts_arriving_together_share_one_batch():
+    async def scenario():
+        batches = []
+
+        async def send_batch(prompts):
+            batches.append(list(prompts))
+            return [p.upper() for p in prompts]
+
+        batcher = PromptBatcher(send_batch, max_size=8, max_wait=0.01)
+        results = await asyncio.gather(*[batcher.submit(p) for p in ("a", "b", "c")])
+        return results, batches
+
+    results, batches = asyncio.run(scenario())
+    assert results == ["A", "B", "C"]
+    assert batches == [["a", "b", "c"]]
+
+
+def test_full_batch_is_sent_without_waiting():
+    async def scenario():
+        batches = []
+
+        async def send_batch(prompts):
+            batches.append(len(prompts))
+            return prompts
+
+        batcher = PromptBatcher(send_batch, max_size=2, max_wait=10)
+        results = await asyncio.wait_for(asyncio.gather(*[batcher.submit(str(i)) for i in range(4)]), 1)
+        return results, batches, batcher.stats
+
+    results, batches, stats = asyncio.run(scenario())
+    assert results == ["0", "1", "2", "3"]
+    assert batches == [2, 2]
+    assert stats == {"batches": 2, "prompts": 4}
+
+
+def test_item_error_does_not_affect_the_rest():
+    async def scenario():
+        async def send_batch(prompts):
+            return [ValueError(p) if p == "bad" else p for p in prompts]
+
+        batcher = PromptBatcher(send_batch, max_wait=0.01)
+        return await asyncio.gather(*[batcher.submit(p) for p in ("ok", "bad")], return_exceptions=True)
+
+    ok, bad = asyncio.run(scenario())
+    assert ok == "ok"
+    assert isinstance(bad, ValueError)
+
+
+def test_batch_failure_fails_every_item():
+    async def scenario():
+        async def send_batch(prompts):
+            raise RuntimeError("503")
+
+        batcher = PromptBatcher(send_batch, max_wait=0.01)
+        return await asyncio.gather(*[batcher.submit(p) for p in ("a", "b")], return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(scenario()))
+
+
+def run_against_server(status, prompts):
+    """_post_batch против мини-сервера, который на список отвечает status, а на строку — 200."""
+    async def scenario():
+        requests = []
+
+        async def handle(request):
+            inputs = (await request.json())["inputs"]
+            requests.append(inputs)
+            if isinstance(inputs, list):
+                return web.json_response({"error": "rejected"}, status=status)
+            return web.json_response([{"generated_text": inputs.upper()}])
+
+        app = web.Application()
+        app.router.add_post("/model", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = hf_client.HF_API_URL
+        hf_client.HF_API_URL = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/model"
+        await hf_client.start_hf_client("test")
+        try:
+            result = await hf_client._post_batch(prompts)
+        except Exception as e:
+            result = e
+        finally:
+            hf_client.HF_API_URL = url
+            await hf_client.close_hf_client()
+            await runner.cleanup()
+        return result, requests
+
+    return asyncio.run(scenario())
+
+
+def test_rejected_batch_is_split():
+    result, requests = run_against_server(422, ["a", "b"])
+    assert result == ["A", "B"]
+    assert requests == [["a", "b"], "a", "b"]
+
+
+def test_overloaded_batch_is_not_split():
+    result, requests = run_against_server(503, ["a", "b"])
+    assert isinstance(result, Exception)
+    assert requests == [["a", "b"]]
@@ -0,0 +1,59 @@
+import pytest
+
+from local_answers import answer_locally, classify_question, fallback_answer
+
+MOVIE = {
+    "title": "Alien",
+    "year": 1979,
+    "runtime": 117,
+    "rating": 8.4,
+    "genres": "horror, science-fiction",
+    "certification": "r",
+    "overview": "The crew of a commercial spacecraft encounters a deadly lifeform.",
+}
+
+
+@pytest.mark.parametrize("question, intent", [
+    ("How long is it?", "runtime"),
+    ("Cik ilgi tā ir?", "runtime"),
+    ("What year did it come out?", "year"),
+    ("Kurā gadā tā iznāca?", "year"),
+    ("Is it scary?", "scary"),
+    ("Vai der bērniem?", "kids"),
+    ("What's the rating?", "rating"),
+    ("What genre is it?", "genre"),
+    ("What's it about?", "plot"),
+    ("Par ko ir filma?", "plot"),
+])
+def test_clear_questions_are_classified(question, intent):
+    assert classify_question(question) == intent
+
+
+@pytest.mark.parametrize("question", [
+    "When does the story take place?",
+    "What year is it set in?",
+    "is this a good movie for a date?",
+    "Kas ir režisors?",
+    "Is it scary for kids?",
+    "",
+])
+def test_unclear_questions_go_to_the_model(question):
+    assert classify_question(question) is None
+    assert answer_locally(MOVIE, question, "English") is None
+
+
+def test_answers_from_movie_fields():
+    assert answer_locally(MOVIE, "How long is it?", "English") == "⏱️ “Alien” runs about 117 minutes."
+    assert "1979" in answer_locally(MOVIE, "Kurā gadā tā iznāca?", "Latviešu")
+    assert answer_locally(MOVIE, "Is it scary?", "English").startswith("👻")
+    assert answer_locally(MOVIE, "Is it ok for kids?", "English").startswith("🔞")
+
+
+def test_missing_field_goes_to_the_model():
+    assert answer_locally(dict(MOVIE, runtime=None), "How long is it?", "English") is None
+    assert answer_locally({}, "How long is it?") is None
+
+
+def test_fallback_answer_uses_the_overview():
+    assert "deadly lifeform" in fallback_answer(MOVIE, "English")
+    assert fallback_answer({"title": "X"}) is None
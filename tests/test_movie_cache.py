@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+from movie_cache import GenreCache, LRUCache
+
+
+class Loader:
+    def __init__(self, delay=0.0, fail=False):
+        self.calls = 0
+        self.delay = delay
+        self.fail = fail
+
+    async def __call__(self, key):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("Trakt nav pieejams")
+        return f"{key}-{self.calls}"
+
+
+def test_concurrent_misses_share_one_request():
+    async def scenario():
+        loader = Loader(delay=0.01)
+        cache = GenreCache(loader)
+        results = await asyncio.gather(*[cache.get("drama") for _ in range(10)])
+        return loader.calls, results, cache.stats
+
+    calls, results, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert results == ["drama-1"] * 10
+    assert stats["misses"] == 10 and stats["coalesced"] == 9
+
+
+def test_fresh_entry_is_served_without_loading():
+    async def scenario():
+        loader = Loader()
+        cache = GenreCache(loader, ttl=60)
+        cache.put("drama", "cached")
+        return await cache.get("drama"), loader.calls
+
+    assert asyncio.run(scenario()) == ("cached", 0)
+
+
+def test_stale_entry_is_served_and_refreshed_in_background():
+    async def scenario():
+        loader = Loader(delay=0.01)
+        cache = GenreCache(loader, ttl=10, stale_ttl=100)
+        cache.put("drama", "old", time.monotonic() - 20)
+        served = await cache.get("drama")
+        # обновление идёт в фоне — ответ его не ждёт
+        before = cache.peek("drama")
+        await asyncio.sleep(0.05)
+        return served, before, cache.peek("drama"), loader.calls, cache.stats["stale_hits"]
+
+    served, before, refreshed, calls, stale_hits = asyncio.run(scenario())
+    assert served == before == "old"
+    assert refreshed == "drama-1"
+    assert calls == 1
+    assert stale_hits == 1
+
+
+def test_expired_entry_falls_back_when_api_fails():
+    async def scenario():
+        loader = Loader(fail=True)
+        cache = GenreCache(loader, ttl=10, stale_ttl=10, slow_timeout=1)
+        cache.put("drama", "old", time.monotonic() - 100)
+        return await cache.get("drama"), cache.stats["fallbacks"]
+
+    assert asyncio.run(scenario()) == ("old", 1)
+
+
+def test_expired_entry_falls_back_when_api_is_slow():
+    async def scenario():
+        loader = Loader(delay=0.5)
+        cache = GenreCache(loader, ttl=10, stale_ttl=10, slow_timeout=0.01)
+        cache.put("drama", "old", time.monotonic() - 100)
+        served = await cache.get("drama")
+        await asyncio.sleep(0.6)
+        return served, cache.peek("drama")
+
+    # медленный ответ не выброшен: он всё равно попадает в кэш
+    assert asyncio.run(scenario()) == ("old", "drama-1")
+
+
+def test_errors_are_not_cached():
+    async def scenario():
+        loader = Loader(fail=True)
+        cache = GenreCache(loader)
+        failures = 0
+        for _ in range(2):
+            try:
+                await cache.get("drama")
+            except RuntimeError:
+                failures += 1
+        return failures, loader.calls, cache.peek("drama")
+
+    assert asyncio.run(scenario()) == (2, 2, None)
+
+
+def test_store_is_read_once_on_first_access():
+    async def scenario():
+        reads = []
+
+        async def store_loader(key):
+            reads.append(key)
+            await asyncio.sleep(0.01)
+            return f"{key}-disk", time.time()
+
+        loader = Loader()
+        cache = GenreCache(loader, ttl=60, store_loader=store_loader)
+        results = await asyncio.gather(*[cache.get("drama") for _ in range(5)])
+        return results, reads, loader.calls
+
+    results, reads, calls = asyncio.run(scenario())
+    assert results == ["drama-disk"] * 5
+    assert reads == ["drama"]
+    assert calls == 0
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
@@ -0,0 +1,83 @@
+import random
+
+from movie_index import GenrePool, movie_key, pick_without_repeat, remember_seen
+
+
+def make_movies(count=50, genres="drama"):
+    return [
+        {"title": f"Movie {i}", "trakt_url": f"https://trakt.tv/movies/m-{i}", "rating": 5 + (i % 50) / 10,
+         "genres": genres, "runtime": 100}
+        for i in range(count)
+    ]
+
+
+def test_pool_prefix_counts_follow_rating():
+    pool = GenrePool(make_movies())
+    assert len(pool) == 50
+    assert pool.count_at_least(0) == 50
+    assert pool.count_at_least(7) == sum(1 for m in make_movies() if m["rating"] >= 7)
+    assert all(pool.movies[i]["rating"] >= 7 for i in range(pool.count_at_least(7)))
+
+
+def test_nearest_threshold_falls_back_to_lower_rating():
+    pool = GenrePool([m for m in make_movies() if m["rating"] < 8])
+    assert pool.nearest_threshold(7) == 7
+    assert pool.nearest_threshold(8.5) == 7
+    assert GenrePool([]).nearest_threshold(5) is None
+
+
+def test_no_repeats_within_one_cycle():
+    random.seed(1)
+    pool = GenrePool(make_movies())
+    cycles, seen = {}, {}
+    picked = []
+    for _ in range(len(pool)):
+        movie, threshold = pick_without_repeat(pool, 0, cycles, seen)
+        assert threshold == 0
+        picked.append(movie_key(movie))
+    assert len(set(picked)) == len(pool)
+
+
+def test_seen_movies_are_skipped():
+    random.seed(2)
+    pool = GenrePool(make_movies(20))
+    seen = {}
+    for movie in pool.movies[:15]:
+        remember_seen(seen, movie_key(movie))
+    cycles = {}
+    for _ in range(5):
+        movie, _ = pick_without_repeat(pool, 0, cycles, seen)
+        assert movie_key(movie) not in seen
+        remember_seen(seen, movie_key(movie))
+
+
+def test_everything_seen_still_returns_a_movie():
+    pool = GenrePool(make_movies(5))
+    seen = {}
+    for movie in pool.movies:
+        remember_seen(seen, movie_key(movie))
+    movie, threshold = pick_without_repeat(pool, 0, {}, seen)
+    assert movie is not None and threshold == 0
+
+
+def test_audience_weights_prefer_matching_movies():
+    random.seed(3)
+    movies = make_movies(50, "comedy, family") + [
+        dict(m, trakt_url=m["trakt_url"] + "-h", genres="horror, thriller, war") for m in make_movies(50)
+    ]
+    pool = GenrePool(movies)
+    picks = {"comedy": 0, "horror": 0}
+    for _ in range(40):
+        cycles = {}
+        for _ in range(5):
+            movie, _ = pick_without_repeat(pool, 0, cycles, {}, audience="together", slot="morning")
+            picks["comedy" if "comedy" in movie["genres"] else "horror"] += 1
+    assert picks["comedy"] > 2 * picks["horror"]
+
+
+def test_remember_seen_keeps_the_newest():
+    seen = {}
+    for i in range(5):
+        remember_seen(seen, f"k{i}", limit=3)
+    remember_seen(seen, "k2", limit=3)
+    assert list(seen) == ["k3", "k4", "k2"]
@@ -0,0 +1,73 @@
+from rate_limit import ALLOWED, DEBOUNCED, LIMITED, UserRateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_limiter(**kwargs):
+    clock = Clock()
+    options = dict(rate=0.5, burst=3, debounce=0.7, idle_ttl=600, clock=clock)
+    options.update(kwargs)
+    return UserRateLimiter(**options), clock
+
+
+def test_burst_then_limited():
+    limiter, clock = make_limiter(rate=0.1)
+    results = []
+    for _ in range(4):
+        results.append(limiter.check(1, "repeat"))
+        clock.now += 0.75  # чуть реже debounce, но быстрее, чем копятся токены
+    assert results == [ALLOWED, ALLOWED, ALLOWED, LIMITED]
+
+
+def test_tokens_refill_over_time():
+    limiter, clock = make_limiter(burst=1)
+    assert limiter.check(1) == ALLOWED
+    clock.now += 1
+    assert limiter.check(1) == LIMITED
+    clock.now += 2
+    assert limiter.check(1) == ALLOWED
+
+
+def test_double_tap_is_debounced_without_spending_a_token():
+    limiter, clock = make_limiter(burst=2)
+    assert limiter.check(1, "repeat") == ALLOWED
+    clock.now += 0.1
+    assert limiter.check(1, "repeat") == DEBOUNCED
+    # другое действие — не дубль
+    assert limiter.check(1, "rating") == ALLOWED
+
+
+def test_users_do_not_share_buckets():
+    limiter, _ = make_limiter(burst=1)
+    assert limiter.check(1) == ALLOWED
+    assert limiter.check(1) == LIMITED
+    assert limiter.check(2) == ALLOWED
+
+
+def test_warns_once_per_run_of_refusals():
+    limiter, clock = make_limiter(burst=1)
+    limiter.check(1)
+    assert limiter.check(1) == LIMITED
+    assert limiter.should_warn(1) is True
+    assert limiter.should_warn(1) is False
+    clock.now += 3
+    assert limiter.check(1) == ALLOWED
+    assert limiter.check(1) == LIMITED
+    assert limiter.should_warn(1) is True
+
+
+def test_idle_users_are_evicted():
+    limiter, clock = make_limiter(idle_ttl=10)
+    limiter.check(1)
+    clock.now += 5
+    limiter.check(2)
+    clock.now += 6
+    limiter.check(3)
+    assert len(limiter) == 2
+    assert limiter.stats["evicted"] == 1
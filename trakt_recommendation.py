@@ -1,8 +1,18 @@
 import os
+import json
+import socket
+import time
 import logging
+import asyncio
+from datetime import datetime, timezone
 import httpx
 import random
 
+from movie_cache import GenreCache
+from catalog_store import CatalogStore
+from movie_index import GenrePool, movie_key
+from metrics import stage_latency, register_collector
+
 logger = logging.getLogger("trakt_recommendation")
 
 TRAKT_CLIENT_ID = os.getenv("TRAKT_CLIENT_ID")
@@ -15,42 +25,514 @@ HEADERS = {
     "trakt-api-key": TRAKT_CLIENT_ID,
 }
 
-async def get_movies_by_genre_and_people(genre, people_type="Viens"):
-    """
-    Получаем список популярных фильмов по жанру.
-    people_type — пока не используется, но можно расширить логику.
-    Возвращаем список словарей с ключами: title, year, genres, overview, trakt_url, rating
-    """
+TRAKT_API_URL = os.getenv("TRAKT_API_URL", "https://api.trakt.tv")
+TRAKT_MAX_CONCURRENCY = int(os.getenv("TRAKT_MAX_CONCURRENCY", "8"))
+TRAKT_TIMEOUT = float(os.getenv("TRAKT_TIMEOUT", "10"))
+TRAKT_CACHE_TTL = float(os.getenv("TRAKT_CACHE_TTL", "600"))
+TRAKT_CACHE_STALE = float(os.getenv("TRAKT_CACHE_STALE", "3600"))
+TRAKT_SLOW_TIMEOUT = float(os.getenv("TRAKT_SLOW_TIMEOUT", "3"))
+CATALOG_DB = os.getenv("CATALOG_DB", "catalog.db")
+TRAKT_RETRIES = int(os.getenv("TRAKT_RETRIES", "3"))
+# Фоновая сборка каталога: сколько страниц по 100 фильмов на жанр и как часто
+TRAKT_DEEP_PAGES = int(os.getenv("TRAKT_DEEP_PAGES", "10"))
+TRAKT_DEEP_PAGE_SIZE = 100
+TRAKT_DEEP_REFRESH = float(os.getenv("TRAKT_DEEP_REFRESH", "21600"))
+# Неудачную или неполную сборку повторяем раньше: через TRAKT_DEEP_RETRY секунд,
+# дальше вдвое дольше с каждой неудачей, но не реже TRAKT_DEEP_REFRESH
+TRAKT_DEEP_RETRY = float(os.getenv("TRAKT_DEEP_RETRY", "60"))
+TRAKT_BACKGROUND_CONCURRENCY = int(os.getenv("TRAKT_BACKGROUND_CONCURRENCY", "2"))
+# Сколько запросов лимита оставляем пользователям — фон при этом остаётся ждать
+TRAKT_RATELIMIT_RESERVE = int(os.getenv("TRAKT_RATELIMIT_RESERVE", "50"))
+# Межпроцессный single-flight: кто взял lease в catalog_store, тот и идёт в Trakt,
+# остальные процессы до TRAKT_LEASE_TTL секунд ждут его запись в общей базе
+TRAKT_LEASE_TTL = float(os.getenv("TRAKT_LEASE_TTL", "30"))
+TRAKT_LEASE_POLL = 0.2
+TRAKT_DEEP_LEASE_TTL = 900
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# Один общий клиент на всё приложение: keep-alive соединения переиспользуются,
+# а семафор не даёт всплеску запросов открыть сотню соединений к Trakt.
+_client = None
+_semaphore = None
+_background_semaphore = None
+_builder_task = None
+catalog_store = None
+# ключ фильма -> Telegram file_id загруженного постера (копия таблицы posters);
+# POSTER_REJECTED + URL вместо file_id — этот URL Telegram уже не принял
+_poster_ids = {}
+POSTER_REJECTED = "rejected:"
+
+# time.monotonic(), до которого не шлём запросы: после 429 — все,
+# а когда лимит почти исчерпан — только фоновые
+_pause_until = 0.0
+_background_pause_until = 0.0
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_trakt_client():
+    global _client, _semaphore
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=TRAKT_API_URL,
+            headers=HEADERS,
+            http2=_http2_available(),
+            timeout=httpx.Timeout(TRAKT_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=TRAKT_MAX_CONCURRENCY,
+                max_keepalive_connections=TRAKT_MAX_CONCURRENCY,
+                keepalive_expiry=60,
+            ),
+        )
+        _semaphore = asyncio.Semaphore(TRAKT_MAX_CONCURRENCY)
+    return _client
+
+
+def _get_background_semaphore():
+    global _background_semaphore
+    if _background_semaphore is None:
+        _background_semaphore = asyncio.Semaphore(TRAKT_BACKGROUND_CONCURRENCY)
+    return _background_semaphore
+
+
+async def start_trakt_client():
+    """Вызывается из post_init приложения, чтобы клиент был готов до первого апдейта."""
+    global catalog_store
+    client = get_trakt_client()
+    if catalog_store is None and CATALOG_DB:
+        # Только открываем базу: сами жанры читаются лениво при первом запросе
+        catalog_store = await asyncio.to_thread(CatalogStore, CATALOG_DB)
+        _poster_ids.update(await asyncio.to_thread(catalog_store.poster_file_ids))
+    logger.info(f"Trakt klients gatavs (http2={_http2_available()}, max={TRAKT_MAX_CONCURRENCY})")
+    return client
+
+
+async def close_trakt_client():
+    global _client, _semaphore, _background_semaphore, catalog_store
+    await stop_catalog_builder()
+    if _client is not None:
+        await _client.aclose()
+    if catalog_store is not None:
+        catalog_store.close()
+    _client = None
+    _semaphore = None
+    _background_semaphore = None
+    catalog_store = None
+
+
+def _note_rate_limit(response):
+    global _pause_until, _background_pause_until
+    now = time.monotonic()
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After", "1"))
+        except ValueError:
+            retry_after = 1.0
+        _pause_until = max(_pause_until, now + retry_after)
+        return
+
+    raw = response.headers.get("X-Ratelimit")
+    if not raw:
+        return
     try:
-        url = f"https://api.trakt.tv/movies/popular?genres={genre}&limit=50&extended=full"
-        response = httpx.get(url, headers=HEADERS)
+        info = json.loads(raw)
+        remaining = int(info.get("remaining"))
+        until = datetime.fromisoformat(info["until"].replace("Z", "+00:00"))
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return
+    if remaining <= TRAKT_RATELIMIT_RESERVE:
+        delay = (until - datetime.now(timezone.utc)).total_seconds()
+        _background_pause_until = max(_background_pause_until, now + max(delay, 0.0))
+
+
+async def _wait_rate_limit(background):
+    until = max(_pause_until, _background_pause_until) if background else _pause_until
+    delay = until - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def _send(client, path, params, background):
+    if background:
+        # фон берёт слот из своего маленького семафора, чтобы не занять все соединения
+        async with _get_background_semaphore(), _semaphore:
+            return await client.get(path, params=params)
+    async with _semaphore:
+        return await client.get(path, params=params)
+
+
+async def trakt_get(path, params=None, background=False):
+    client = get_trakt_client()
+    for attempt in range(TRAKT_RETRIES + 1):
+        await _wait_rate_limit(background)
+        with stage_latency.time(stage="trakt_request"):
+            response = await _send(client, path, params, background)
+        _note_rate_limit(response)
+        if response.status_code == 429 and attempt < TRAKT_RETRIES:
+            logger.warning(f"Trakt rate limit ({path}), gaidām {response.headers.get('Retry-After', '1')} s")
+            continue
         response.raise_for_status()
+        return response
+
+
+def normalize_movie(movie, genre):
+    trakt_url = f"https://trakt.tv/movies/{movie['ids']['slug']}"
+    genres_list = movie.get("genres", [])
+    genres = ', '.join([g['name'] if isinstance(g, dict) else g for g in genres_list]) or genre.capitalize()
+
+    # Некоторые фильмы могут не иметь рейтинга, поставим 0
+    rating = movie.get("rating", 0)
 
-        movies = response.json()
-        if not movies:
-            return []
+    # extended=images отдаёт адреса без схемы: "walter-r2.trakt.tv/images/..."
+    posters = (movie.get("images") or {}).get("poster") or []
+    poster = posters[0] if posters else None
+    if poster and not poster.startswith("http"):
+        poster = "https://" + poster
 
-        result = []
+    return {
+        "title": movie.get("title"),
+        "year": movie.get("year"),
+        "genres": genres,
+        "overview": movie.get("overview", "Apraksts nav pieejams."),
+        "trakt_url": trakt_url,
+        "rating": rating,
+        "trakt_id": movie["ids"].get("trakt"),
+        "runtime": movie.get("runtime"),
+        "certification": movie.get("certification"),
+        "poster": poster,
+        # Можно добавить и другие поля, если нужно
+    }
+
+
+def merge_movies(*lists):
+    """Объединяет списки без дублей по ids.trakt; более поздние списки свежее."""
+    merged = {}
+    for movies in lists:
         for movie in movies:
-            trakt_url = f"https://trakt.tv/movies/{movie['ids']['slug']}"
-            genres_list = movie.get("genres", [])
-            genres = ', '.join([g['name'] if isinstance(g, dict) else g for g in genres_list]) or genre.capitalize()
+            merged[movie.get("trakt_id") or movie["trakt_url"]] = movie
+    return list(merged.values())
+
+
+async def save_genre(genre, movies):
+    if catalog_store is None:
+        return
+    try:
+        await asyncio.to_thread(catalog_store.save_genre, genre, movies)
+    except Exception as e:
+        logger.error(f"Neizdevās saglabāt katalogu ({genre}): {e}")
+
+
+async def make_pool(movies):
+    """GenrePool в потоке: сортировка и веса тысяч фильмов не должны блокировать loop."""
+    return await asyncio.to_thread(GenrePool, movies)
+
+
+async def merge_saved_genre(genre, fresh):
+    """
+    Вливает свежую первую страницу в общий каталог жанра: основа — то, что
+    сохранено на диске (там может быть глубокий каталог, собранный другим
+    процессом), а если диска нет — пул в памяти. Чтение и запись — одна транзакция.
+    """
+    current = genre_cache.peek(genre)
+
+    def update(stored):
+        base = stored or (current.movies if current else [])
+        return merge_movies(base, fresh)
+
+    if catalog_store is None:
+        return update([])
+    try:
+        return await asyncio.to_thread(catalog_store.update_genre, genre, update)
+    except Exception as e:
+        logger.error(f"Neizdevās saglabāt katalogu ({genre}): {e}")
+        return update([])
+
+
+async def fetch_page(genre, page=1, limit=50, background=False):
+    """Одна страница /movies/popular: (нормализованные фильмы, всего страниц)."""
+    response = await trakt_get(
+        "/movies/popular",
+        params={"genres": genre, "limit": limit, "page": page, "extended": "full,images"},
+        background=background,
+    )
+    movies = response.json() or []
+    try:
+        page_count = int(response.headers.get("X-Pagination-Page-Count", page))
+    except ValueError:
+        page_count = page
+    return [normalize_movie(movie, genre) for movie in movies], page_count
+
+
+async def acquire_lease(name, ttl=TRAKT_LEASE_TTL):
+    if catalog_store is None:
+        return True
+    try:
+        return await asyncio.to_thread(catalog_store.acquire_lease, name, LEASE_OWNER, ttl)
+    except Exception as e:
+        # без общей базы координироваться не с кем — идём сами
+        logger.error(f"Neizdevās paņemt lease {name}: {e}")
+        return True
+
+
+async def release_lease(name):
+    if catalog_store is None:
+        return
+    try:
+        await asyncio.to_thread(catalog_store.release_lease, name, LEASE_OWNER)
+    except Exception as e:
+        logger.error(f"Neizdevās atbrīvot lease {name}: {e}")
 
-            # Некоторые фильмы могут не иметь рейтинга, поставим 0
-            rating = movie.get("rating", 0)
 
-            result.append({
-                "title": movie.get("title"),
-                "year": movie.get("year"),
-                "genres": genres,
-                "overview": movie.get("overview", "Apraksts nav pieejams."),
-                "trakt_url": trakt_url,
-                "rating": rating,
-                # Можно добавить и другие поля, если нужно
-            })
+async def wait_for_peer(genre, lease, before, timeout=TRAKT_LEASE_TTL):
+    """
+    Жанр уже качает другой процесс: ждём, пока он перезапишет жанр в общей базе
+    (fetched_at отличается от before), и читаем оттуда. Если он отпустил lease
+    без записи (Trakt не ответил) — None сразу, не дожидаясь timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(TRAKT_LEASE_POLL)
+        # сначала lease, потом fetched_at: запись делается до release, так что её не пропустим
+        held = await asyncio.to_thread(catalog_store.lease_held, lease)
+        fetched_at = await asyncio.to_thread(catalog_store.genre_fetched_at, genre)
+        if fetched_at is not None and fetched_at != before:
+            stored = await load_stored_genre(genre)
+            if stored is not None:
+                return stored[0]
+        if not held:
+            return None
+    return None
+
+
+async def fetch_genre_movies(genre):
+    """
+    Первая страница жанра без обработки ошибок — используется кэшем.
+    Внутри процесса запросы сливает GenreCache, между процессами — lease.
+    """
+    lease = f"fetch:{genre}"
+    before = await asyncio.to_thread(catalog_store.genre_fetched_at, genre) if catalog_store else None
+    if not await acquire_lease(lease):
+        pool = await wait_for_peer(genre, lease, before)
+        if pool is not None:
+            return pool
+        logger.warning(f"Cits process nepaspēja ielādēt {genre}, ielādējam paši")
+    try:
+        result, _ = await fetch_page(genre)
+        if not result:
+            return GenrePool([])
+        # не теряем глубокий каталог — ни свой, ни собранный другим процессом
+        return await make_pool(await merge_saved_genre(genre, result))
+    finally:
+        await release_lease(lease)
+
+
+async def load_stored_genre(genre):
+    if catalog_store is None:
+        return None
+    stored = await asyncio.to_thread(catalog_store.load_genre, genre)
+    if stored is None:
+        return None
+    movies, fetched_at = stored
+    return await make_pool(movies), fetched_at
+
+
+genre_cache = GenreCache(
+    fetch_genre_movies,
+    ttl=TRAKT_CACHE_TTL,
+    stale_ttl=TRAKT_CACHE_STALE,
+    store_loader=load_stored_genre,
+    slow_timeout=TRAKT_SLOW_TIMEOUT,
+)
+
+
+async def build_genre_catalog(genre, pages=TRAKT_DEEP_PAGES):
+    """
+    Фоновая сборка глубокого каталога жанра: страницы качаются параллельно
+    (в пределах фонового семафора), каждая сразу вливается в пул кэша,
+    а в конце пул заменяется полным свежим списком и пишется на диск.
+    Пулы строятся в потоке (make_pool), так что loop не стоит на каждой странице.
+    True, только если загрузились все страницы: лишь тогда каталог помечается
+    свежим (meta deep:{genre}); неполный только дополняет сохранённый.
+    """
+    first, page_count = await fetch_page(genre, 1, TRAKT_DEEP_PAGE_SIZE, background=True)
+    fresh = list(first)
+
+    async def merge_into_cache(batch):
+        current = genre_cache.peek(genre)
+        genre_cache.put(genre, await make_pool(merge_movies(current.movies, batch) if current else batch))
+
+    if first:
+        await merge_into_cache(first)
+
+    tasks = [
+        fetch_page(genre, page, TRAKT_DEEP_PAGE_SIZE, background=True)
+        for page in range(2, min(pages, page_count) + 1)
+    ]
+    failed = 0
+    for future in asyncio.as_completed(tasks):
+        try:
+            batch, _ = await future
+        except Exception as e:
+            logger.warning(f"Kataloga lapa neielādējās ({genre}): {e}")
+            failed += 1
+            continue
+        fresh.extend(batch)
+        await merge_into_cache(batch)
+
+    movies = merge_movies(fresh)
+    if movies and failed:
+        # без пропавших страниц полный список на диске затирать нельзя — только дополняем
+        await merge_saved_genre(genre, movies)
+    elif movies:
+        genre_cache.put(genre, await make_pool(movies))
+        await save_genre(genre, movies)
+        if catalog_store is not None:
+            await asyncio.to_thread(catalog_store.set_meta, f"deep:{genre}", time.time())
+    total = min(pages, page_count)
+    logger.info(f"Katalogs {genre}: {len(movies)} filmas no {total - failed}/{total} lapām")
+    return not failed
+
+
+async def _deep_catalog_is_fresh(genre):
+    if catalog_store is None:
+        return False
+    built_at = await asyncio.to_thread(catalog_store.get_meta, f"deep:{genre}", 0)
+    return time.time() - built_at < TRAKT_DEEP_REFRESH
 
-        return result
+
+async def _build_if_stale(genre):
+    """False, если сборка упала или загрузились не все страницы — жанр надо повторить."""
+    lease = f"deep:{genre}"
+    try:
+        # глубокий каталог строит один процесс; остальные подхватят его с диска
+        # при следующем обновлении жанра (merge_saved_genre)
+        if await _deep_catalog_is_fresh(genre) or not await acquire_lease(lease, TRAKT_DEEP_LEASE_TTL):
+            return True
+        try:
+            # пока мы брали lease, другой процесс мог как раз достроить каталог
+            if await _deep_catalog_is_fresh(genre):
+                return True
+            return await build_genre_catalog(genre)
+        finally:
+            await release_lease(lease)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Kataloga veidošana neizdevās ({genre}): {e}")
+        return False
+
+
+async def _catalog_builder(genres):
+    pending = list(genres)
+    failures = 0
+    while True:
+        failed = [genre for genre in pending if not await _build_if_stale(genre)]
+        if failed:
+            # Trakt лежал при старте или часть страниц не пришла — не ждём 6 часов
+            failures += 1
+            delay = min(TRAKT_DEEP_RETRY * 2 ** (failures - 1), TRAKT_DEEP_REFRESH)
+            logger.warning(f"Katalogs nav pilns ({', '.join(failed)}), atkārtosim pēc {delay:.0f} s")
+            pending = failed
+        else:
+            failures = 0
+            delay = TRAKT_DEEP_REFRESH
+            pending = list(genres)
+        await asyncio.sleep(delay)
+
+
+def start_catalog_builder(genres):
+    global _builder_task
+    if _builder_task is None and TRAKT_DEEP_PAGES > 0:
+        _builder_task = asyncio.create_task(_catalog_builder(list(genres)))
+    return _builder_task
+
+
+async def stop_catalog_builder():
+    global _builder_task
+    if _builder_task is not None:
+        _builder_task.cancel()
+        try:
+            await _builder_task
+        except asyncio.CancelledError:
+            pass
+        _builder_task = None
+
+
+def cache_stats():
+    return genre_cache.snapshot()
+
+
+def _collect_cache_metrics():
+    stats = genre_cache.snapshot()
+    events = [({"event": key}, value) for key, value in genre_cache.stats.items()]
+    return [
+        ("meowie_genre_cache_events_total", "counter", "Genre cache hits, misses, refreshes and errors.", events),
+        ("meowie_genre_cache_entries", "gauge", "Genres currently cached.", [({}, stats["entries"])]),
+    ]
+
+
+register_collector(_collect_cache_metrics)
+
+
+async def get_genre_pool(genre):
+    """GenrePool жанра из кэша (или None, если Trakt недоступен и кэш пуст)."""
+    try:
+        with stage_latency.time(stage="genre_pool"):
+            return await genre_cache.get(genre)
 
     except Exception as e:
         logger.error(f"Kļūda trakt API: {e}")
-        return []
+        return None
+
+
+def poster_file_id(movie):
+    """Telegram file_id уже загруженного постера фильма или None."""
+    file_id = _poster_ids.get(movie_key(movie))
+    return None if file_id is None or file_id.startswith(POSTER_REJECTED) else file_id
+
+
+def poster_rejected(movie):
+    """True, если текущий URL постера Telegram уже отверг — пробовать его снова незачем."""
+    url = movie.get("poster")
+    return bool(url) and _poster_ids.get(movie_key(movie)) == POSTER_REJECTED + url
+
+
+async def remember_poster(movie, file_id):
+    key = movie_key(movie)
+    if not key or _poster_ids.get(key) == file_id:
+        return
+    _poster_ids[key] = file_id
+    if catalog_store is None:
+        return
+    try:
+        await asyncio.to_thread(catalog_store.save_poster, key, file_id)
+    except Exception as e:
+        logger.error(f"Neizdevās saglabāt plakātu ({key}): {e}")
+
+
+async def reject_poster(movie):
+    """Запоминает (и в таблице posters), что URL постера не принят; новый URL из каталога попробуем заново."""
+    if movie.get("poster"):
+        await remember_poster(movie, POSTER_REJECTED + movie["poster"])
+
+
+async def forget_poster(movie):
+    key = movie_key(movie)
+    if _poster_ids.pop(key, None) is None or catalog_store is None:
+        return
+    try:
+        await asyncio.to_thread(catalog_store.delete_poster, key)
+    except Exception as e:
+        logger.error(f"Neizdevās dzēst plakātu ({key}): {e}")
+
+
+def prefetch_genre(genre):
+    """Греем пул жанра заранее (пока пользователь выбирает время и рейтинг)."""
+    if genre:
+        genre_cache.prefetch(genre)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger("webhook")
+
+
+def update_chat_key(update):
+    """По какому ключу упорядочиваем апдейты: чат, а если его нет — пользователь."""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Апдейты разных чатов обрабатываются параллельно (до max_concurrent_updates),
+    а апдейты одного чата — строго по очереди, чтобы ConversationHandler и
+    user_data не видели гонок. Замок на чат живёт, пока у чата есть апдейты.
+
+    Слот из общего семафора берёт только апдейт, дошедший до головы очереди
+    своего чата: иначе чат с сотней апдейтов в очереди (скрипт, жмущий кнопку)
+    занял бы все слоты ожиданием своего замка, и остальные чаты стояли бы.
+    Поэтому process_update переопределён, а не только do_process_update.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # key -> [asyncio.Lock, сколько апдейтов ждут/обрабатываются]
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+
+    async def process_update(self, update, coroutine):
+        key = update_chat_key(update) if isinstance(update, Update) else None
+        if key is None:
+            async with self._slots:
+                await self.do_process_update(update, coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # сначала очередь чата (asyncio.Lock честный — порядок сохраняется), потом слот
+            async with entry[0], self._slots:
+                await self.do_process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def make_web_app(app, path="/telegram", secret_token=None):
+    """aiohttp-приложение, которое принимает апдейты Telegram и кладёт их в update_queue."""
+
+    async def handle_update(request):
+        if secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await app.update_queue.put(Update.de_json(data, app.bot))
+        return web.Response()
+
+    web_app = web.Application()
+    web_app.router.add_post(path, handle_update)
+    return web_app
+
+
+async def serve_webhook(app, listen="0.0.0.0", port=8443, path="/telegram",
+                        webhook_url=None, secret_token=None, stop_event=None, web_app=None):
+    """
+    Запускает бота в режиме webhook на своём aiohttp-сервере.
+    run_polling/run_webhook сами вызывают post_init/post_shutdown, поэтому здесь
+    повторяем их порядок вручную. Работает, пока не выставлен stop_event
+    (по умолчанию — SIGINT/SIGTERM).
+    """
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+    web_app = web_app or make_web_app(app, path, secret_token)
+    runner = web.AppRunner(web_app)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    if webhook_url:
+        await app.bot.set_webhook(
+            url=webhook_url.rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    await app.start()
+    await runner.setup()
+    site = web.TCPSite(runner, listen, port)
+    await site.start()
+    logger.info(f"Webhook klausās {listen}:{port}{path}")
+
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)